@@ -1,5 +1,46 @@
 import os
+import re
+import time
+import hashlib
 import ydb
+import ydb.aio
+import ydb.aio.iam
+from utils.logger import get_logger
+from utils.metrics import span
+
+logger = get_logger(__name__)
+
+# Порог медленного запроса, мс. Серверную статистику (прочитанные строки,
+# CPU) ydb 3.19 для запросов с данными не возвращает - учитываются
+# длительность на клиенте и число возвращенных строк
+SLOW_QUERY_MS = float(os.getenv('YDB_SLOW_QUERY_MS', '500'))
+
+# Режимы транзакций execute_query. Чтение без записи не берет блокировок:
+# snapshot - согласованный срез на момент начала, stale - возможно
+# немного устаревшие данные с ближайшей реплики, online - последние
+# зафиксированные данные без согласованности между чтениями
+TX_MODES = {
+    'serializable': ydb.SerializableReadWrite,
+    'snapshot': ydb.SnapshotReadOnly,
+    'stale': ydb.StaleReadOnly,
+    'online': ydb.OnlineReadOnly
+}
+
+def query_fingerprint(query):
+    """
+    Отпечаток запроса: текст без DECLARE, комментариев и литералов.
+    Возвращает (хэш, краткое описание для логов)
+    """
+    lines = [
+        line for line in query.splitlines()
+        if line.strip() and not line.strip().upper().startswith('DECLARE') and not line.strip().startswith('--')
+    ]
+    normalized = ' '.join(' '.join(lines).split())
+    normalized = re.sub(r"'[^']*'", '?', normalized)
+    normalized = re.sub(r'\b\d+[lu]?\b', '?', normalized)
+    
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+    return digest, normalized[:120]
 
 class YDBConnection:
     def __init__(self):
@@ -11,53 +52,169 @@ class YDBConnection:
         
         self.driver = None
         self.session_pool = None
+        
+        # Статистика кэша подготовленных запросов (сам кэш - в состоянии
+        # сессии SDK; промах означает запрос PrepareDataQuery к серверу)
+        self.prepared_cache_hits = 0
+        self.prepared_cache_misses = 0
+        
+        # Счётчики по отпечаткам запросов: хэш -> агрегаты
+        self.query_stats = {}
     
-    def connect(self):
-        """Создание подключения к YDB"""
+    async def connect(self):
+        """Создание подключения к YDB (повторный вызов переиспользует пул)"""
+        if self.session_pool:
+            return True
+        
         try:
-            self.driver = ydb.Driver(
+            self.driver = ydb.aio.Driver(
                 endpoint=self.endpoint,
                 database=self.database,
-                credentials=ydb.iam.MetadataUrlCredentials()
+                credentials=ydb.aio.iam.MetadataUrlCredentials()
             )
             
             # Ожидание готовности драйвера
-            self.driver.wait(fail_fast=True, timeout=5)
+            await self.driver.wait(fail_fast=True, timeout=5)
             
             # Создание пула сессий
-            self.session_pool = ydb.SessionPool(self.driver, size=10)
+            self.session_pool = ydb.aio.SessionPool(self.driver, size=10)
             
             return True
             
         except Exception as e:
-            print(f"Ошибка подключения к YDB: {e}")
+            logger.error(f"Ошибка подключения к YDB: {e}")
             return False
     
-    def execute_query(self, query, parameters=None):
-        """Выполнение запроса к базе данных"""
+    async def retry_operation(self, callee, *args, **kwargs):
+        """Выполнение callee(session, ...) с повторами на сессии из пула"""
         if not self.session_pool:
             raise Exception("Нет подключения к базе данных")
         
-        def callee(session):
-            if parameters:
-                prepared_query = session.prepare(query)
-                return session.transaction().execute(
+        with span('db'):
+            return await self.session_pool.retry_operation(callee, *args, **kwargs)
+    
+    async def prepare(self, session, query):
+        """
+        Подготовка запроса через кэш SDK. Session.prepare возвращает
+        DataQuery из кэша сессии (LRU на 1000 запросов), а на промахе
+        компилирует запрос на сервере (PrepareDataQuery) и запоминает его.
+        Кэш сбрасывается вместе с сессией, если та стала недействительной
+        """
+        if session.has_prepared(query):
+            self.prepared_cache_hits += 1
+        else:
+            self.prepared_cache_misses += 1
+        
+        return await session.prepare(query)
+    
+    def get_prepared_cache_stats(self):
+        """Статистика кэша подготовленных запросов: misses - число компиляций на сервере"""
+        return {
+            'hits': self.prepared_cache_hits,
+            'misses': self.prepared_cache_misses
+        }
+    
+    def get_query_stats(self, top=None):
+        """Агрегаты по отпечаткам запросов, по убыванию суммарного времени"""
+        stats = sorted(self.query_stats.values(), key=lambda item: item['total_ms'], reverse=True)
+        return stats[:top] if top else stats
+    
+    def reset_query_stats(self):
+        """Сброс агрегатов (для замеров)"""
+        self.query_stats.clear()
+    
+    def _record_query(self, query, duration_ms, result=None, error=None):
+        """Учет выполнения запроса в агрегатах и журнал медленных запросов"""
+        digest, text = query_fingerprint(query)
+        
+        stats = self.query_stats.get(digest)
+        if stats is None:
+            stats = self.query_stats[digest] = {
+                'fingerprint': digest,
+                'query': text,
+                'calls': 0,
+                'errors': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'rows_returned': 0
+            }
+        
+        rows_returned = sum(len(result_set.rows) for result_set in result or [])
+        
+        stats['calls'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['total_ms'] = round(stats['total_ms'] + duration_ms, 1)
+        stats['max_ms'] = round(max(stats['max_ms'], duration_ms), 1)
+        stats['rows_returned'] += rows_returned
+        
+        if duration_ms >= SLOW_QUERY_MS:
+            logger.warning(
+                f"Медленный запрос {digest}: {round(duration_ms, 1)} мс",
+                extra={
+                    'query_fingerprint': digest,
+                    'query': text,
+                    'duration_ms': round(duration_ms, 1),
+                    'rows_returned': rows_returned
+                }
+            )
+    
+    async def execute_query(self, query, parameters=None, tx_mode=None):
+        """
+        Выполнение запроса к базе данных
+        Запросы с parameters (в том числе пустым словарём) выполняются
+        через кэш подготовленных запросов.
+        tx_mode - ключ TX_MODES (по умолчанию serializable); запросы
+        только на чтение выполняются в режиме 'snapshot' или 'stale'.
+        Длительность и число строк учитываются в query_stats
+        """
+        async def callee(session):
+            tx = session.transaction(TX_MODES[tx_mode or 'serializable']())
+            if parameters is not None:
+                prepared_query = await self.prepare(session, query)
+                return await tx.execute(
                     prepared_query,
                     parameters,
                     commit_tx=True
                 )
             else:
-                return session.transaction().execute(
+                return await tx.execute(
                     query,
                     commit_tx=True
                 )
         
-        return self.session_pool.retry_operation_sync(callee)
+        started = time.perf_counter()
+        try:
+            result = await self.retry_operation(callee)
+        except Exception as e:
+            self._record_query(query, (time.perf_counter() - started) * 1000, error=e)
+            raise
+        
+        self._record_query(query, (time.perf_counter() - started) * 1000, result)
+        return result
+    
+    async def execute_scheme(self, query):
+        """Выполнение DDL-запроса (CREATE/ALTER TABLE)"""
+        async def callee(session):
+            return await session.execute_scheme(query)
+        
+        return await self.retry_operation(callee)
+    
+    async def explain(self, query):
+        """Получение плана запроса в виде JSON-строки"""
+        async def callee(session):
+            explanation = await session.explain(query)
+            return explanation.query_plan
+        
+        return await self.retry_operation(callee)
     
-    def close(self):
+    async def close(self):
         """Закрытие подключения"""
+        if self.session_pool:
+            await self.session_pool.stop()
+            self.session_pool = None
         if self.driver:
-            self.driver.stop()
+            await self.driver.stop()
+            self.driver = None
 
 # Глобальная переменная для подключения
-db_connection = YDBConnection()
\ No newline at end of file
+db_connection = YDBConnection()
@@ -0,0 +1,131 @@
+import copy
+import json
+import time
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from .connection import db_connection
+from .models import to_bytes
+
+# Состояния и данные хранятся в fsm_states; строки брошенных мастеров
+# удаляет TTL таблицы (см. DatabaseManager.create_tables)
+FLUSH_QUERY = """
+DECLARE $rows AS List<Struct<storage_key: String, state: String?, data: String, updated_at: Timestamp>>;
+DECLARE $deleted AS List<Struct<storage_key: String>>;
+
+UPSERT INTO fsm_states
+SELECT storage_key, state, data, updated_at FROM AS_TABLE($rows);
+
+DELETE FROM fsm_states ON
+SELECT storage_key FROM AS_TABLE($deleted);
+"""
+
+READ_QUERY = """
+DECLARE $storage_key AS String;
+
+SELECT state, data
+FROM fsm_states
+WHERE storage_key = $storage_key;
+"""
+
+class YDBStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в YDB.
+    Чтения кэшируются до конца обработки обновления, изменения копятся
+    в памяти и записываются одним запросом в flush()
+    """
+    
+    def __init__(self):
+        self._entries = {}
+        self._dirty = set()
+    
+    @staticmethod
+    def _build_key(key):
+        """Строковый ключ записи из StorageKey"""
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id,
+            key.chat_id,
+            key.user_id,
+            key.thread_id,
+            key.business_connection_id,
+            key.destiny
+        ))
+    
+    async def _load(self, key):
+        """Запись из кэша, при промахе - из базы"""
+        storage_key = self._build_key(key)
+        entry = self._entries.get(storage_key)
+        
+        if entry is None:
+            entry = {'state': None, 'data': {}}
+            result = await db_connection.execute_query(READ_QUERY, {
+                '$storage_key': to_bytes(storage_key)
+            }, tx_mode='snapshot')
+            if result[0].rows:
+                row = result[0].rows[0]
+                if row.state:
+                    entry['state'] = row.state.decode('utf-8')
+                if row.data:
+                    entry['data'] = json.loads(row.data)
+            self._entries[storage_key] = entry
+        
+        return storage_key, entry
+    
+    async def set_state(self, key, state=None):
+        storage_key, entry = await self._load(key)
+        entry['state'] = state.state if isinstance(state, State) else state
+        self._dirty.add(storage_key)
+    
+    async def get_state(self, key):
+        _, entry = await self._load(key)
+        return entry['state']
+    
+    async def set_data(self, key, data):
+        storage_key, entry = await self._load(key)
+        entry['data'] = copy.deepcopy(data)
+        self._dirty.add(storage_key)
+    
+    async def get_data(self, key):
+        _, entry = await self._load(key)
+        return copy.deepcopy(entry['data'])
+    
+    async def flush(self):
+        """Запись изменённых записей одним запросом и сброс кэша чтений"""
+        dirty = self._dirty
+        self._dirty = set()
+        
+        rows = []
+        deleted = []
+        updated_at = int(time.time() * 1000000)
+        
+        for storage_key in dirty:
+            entry = self._entries[storage_key]
+            if entry['state'] is None and not entry['data']:
+                # Пустое состояние (после state.clear()) не храним
+                deleted.append({'storage_key': to_bytes(storage_key)})
+            else:
+                rows.append({
+                    'storage_key': to_bytes(storage_key),
+                    'state': to_bytes(entry['state']),
+                    'data': to_bytes(json.dumps(entry['data'], ensure_ascii=False, default=str)),
+                    'updated_at': updated_at
+                })
+        
+        try:
+            if rows or deleted:
+                await db_connection.execute_query(FLUSH_QUERY, {
+                    '$rows': rows,
+                    '$deleted': deleted
+                })
+        except Exception:
+            # Несохранённые изменения будут записаны при следующем flush()
+            self._dirty |= dirty
+            raise
+        
+        # Без изменений в кэше остаются только ещё не записанные записи:
+        # следующее обновление может прийти после изменения на другом экземпляре
+        for storage_key in list(self._entries):
+            if storage_key not in self._dirty:
+                del self._entries[storage_key]
+    
+    async def close(self):
+        await self.flush()
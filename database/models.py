@@ -1,6 +1,13 @@
+import json
 import uuid
+import calendar
+import ydb
 from datetime import datetime, timezone, timedelta
 from .connection import db_connection
+from utils.cache import TTLCache
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 def parse_deadline(deadline_value):
     """Универсальная функция парсинга дедлайна из YDB"""
@@ -21,7 +28,7 @@ def parse_deadline(deadline_value):
         
         return deadline_dt.strftime('%d.%m.%Y %H:%M')
     except Exception as e:
-        print(f"Ошибка парсинга даты {deadline_value}: {e}")
+        logger.error(f"Ошибка парсинга даты {deadline_value}: {e}")
         return 'Дата некорректна'
 
 
@@ -36,10 +43,217 @@ def get_current_time():
     """Получение текущего времени в нужном часовом поясе"""
     return datetime.now(TIMEZONE)
 
+# Кэш пользователей по telegram_id. Время жизни ограничивает устаревание
+# данных, изменённых другим экземпляром функции
+_user_cache = TTLCache(max_size=1000, ttl=60)
+
+# Карточки задач (задача и файлы): task_id -> {'task', 'files'}.
+# Изменения на этом экземпляре сбрасывают запись сразу, на других -
+# становятся видны по истечении ttl
+_task_details_cache = TTLCache(max_size=500, ttl=60)
+
+# Недавно обработанные update_id этого экземпляра - быстрая проверка без YDB
+_seen_updates = TTLCache(max_size=10000, ttl=3600)
+
+def to_bytes(value):
+    """Подготовка строкового значения для параметра типа String"""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+def to_timestamp(value):
+    """
+    Подготовка времени для параметра типа Timestamp (микросекунды).
+    Часовой пояс не учитывается - как в прежнем формате Timestamp('...Z')
+    """
+    return calendar.timegm(value.timetuple()) * 1000000 + value.microsecond
+
+# Размер страницы списка задач
+TASKS_PAGE_SIZE = 15
+
+STATUS_EMOJI = {
+    'new': '🆕',
+    'in_progress': '⏳', 
+    'completed': '✅',
+    'overdue': '⚠️',
+    'cancelled': '❌'
+}
+
+def encode_task_cursor(task):
+    """Курсор задачи для постраничного вывода: '<created_at в мкс>_<task_id>'"""
+    created_at = task['created_at']
+    if isinstance(created_at, datetime):
+        created_at = to_timestamp(created_at)
+    return f"{created_at}_{task['task_id']}"
+
+def decode_task_cursor(cursor):
+    """Разбор курсора задачи в (created_at в мкс, task_id)"""
+    created_at, task_id = cursor.split('_', 1)
+    return int(created_at), task_id
+
+def build_task_list_item(row):
+    """Элемент списка задач из строки результата запроса"""
+    def decode_if_bytes(value):
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value
+    
+    deadline_str = parse_deadline(row.deadline)
+    
+    # Форматируем для отображения в списке (только дата)
+    try:
+        if isinstance(row.deadline, str) and 'T' in row.deadline:
+            deadline_dt = datetime.fromisoformat(row.deadline.replace('Z', '+00:00'))
+        elif isinstance(row.deadline, int):
+            deadline_timestamp = row.deadline / 1000000
+            deadline_dt = datetime.fromtimestamp(deadline_timestamp)
+        else:
+            deadline_dt = row.deadline
+        
+        deadline_short = deadline_dt.strftime('%d.%m')
+    except:
+        deadline_short = deadline_str
+    
+    status = decode_if_bytes(row.status)
+    
+    return {
+        'task_id': decode_if_bytes(row.task_id),
+        'title': decode_if_bytes(row.title),
+        'description': decode_if_bytes(row.description),
+        'is_urgent': row.is_urgent,
+        'status': status,
+        'deadline_str': deadline_str,
+        'deadline_short': deadline_short,
+        'created_at': row.created_at,
+        'company_name': decode_if_bytes(row.company_name) or '',
+        'status_emoji': STATUS_EMOJI.get(status, '❓')
+    }
+
+def build_task_detail(row):
+    """Подробная информация о задаче из строки результата запроса"""
+    def decode_if_bytes(value):
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value
+    
+    return {
+        'task_id': decode_if_bytes(row.task_id),
+        'title': decode_if_bytes(row.title),
+        'description': decode_if_bytes(row.description),
+        'is_urgent': row.is_urgent,
+        'status': decode_if_bytes(row.status),
+        'deadline_str': parse_deadline(row.deadline),
+        'created_at': row.created_at,
+        'company_name': decode_if_bytes(row.company_name) or '',
+        'initiator_name': decode_if_bytes(row.initiator_name),
+        'initiator_phone': decode_if_bytes(row.initiator_phone)
+    }
+
+def build_task_file(row):
+    """Файл задачи с именем загрузившего из строки результата запроса"""
+    def decode_if_bytes(value):
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value
+    
+    uploader_name = f"{decode_if_bytes(row.first_name) or ''} {decode_if_bytes(row.last_name) or ''}".strip()
+    if not uploader_name:
+        uploader_name = decode_if_bytes(row.username) or "Неизвестный"
+    
+    return {
+        'file_id': decode_if_bytes(row.file_id),
+        'file_name': decode_if_bytes(row.file_name),
+        'file_path': decode_if_bytes(row.file_path),
+        'file_size': row.file_size,
+        'content_type': decode_if_bytes(row.content_type),
+        'thumbnail_path': decode_if_bytes(row.thumbnail_path),
+        'created_at': row.created_at,
+        'uploader_name': uploader_name
+    }
+
+# Вторичные индексы: (таблица, индекс, колонки)
+SECONDARY_INDEXES = [
+    ("tasks", "idx_created_at", "created_at"),
+    ("tasks", "idx_assignee_created", "assignee_id, created_at"),
+    ("tasks", "idx_company_created", "company_id, created_at"),
+    ("tasks", "idx_deadline", "deadline"),
+    ("task_files", "idx_task_id", "task_id"),
+    ("task_comments", "idx_task_id", "task_id")
+]
+
+# Колонки, добавленные после создания таблиц: (таблица, колонка, тип)
+ADDED_COLUMNS = [
+    ("tasks", "company_name", "String")
+]
+
+# Таблицы, которые частые запросы не должны читать целиком
+INDEXED_TABLES = ("users", "tasks", "task_files", "task_comments")
+
+# Допустимые полные чтения: {запрос: (таблица или индекс,)}.
+# Первая страница директора и менеджера - все задачи от новых к старым:
+# idx_created_at читается в обратном порядке без границ ключа, но не дальше
+# $limit строк (ReadLimit в плане), поэтому стоимость не растёт с числом задач
+KNOWN_FULL_SCANS = {
+    "get_user_tasks_page_director_first": ("tasks/idx_created_at",)
+}
+
+def scanned_table(path, tables):
+    """
+    Таблица из пути в плане запроса или None, если она не из tables.
+    Чтение индекса выглядит как <таблица>/<индекс>/indexImplTable
+    и возвращается как 'таблица/индекс'
+    """
+    segments = [segment for segment in str(path).split('/') if segment]
+    
+    for index in range(len(segments) - 1, -1, -1):
+        if segments[index] in tables:
+            if segments[-1] == 'indexImplTable' and index + 2 < len(segments):
+                return f"{segments[index]}/{segments[index + 1]}"
+            return segments[index]
+    
+    return None
+
+def is_already_exists(error):
+    """Ошибка схемы YDB: таблица, колонка или индекс уже существуют"""
+    return isinstance(error, ydb.issues.AlreadyExists) or "already exists" in str(error)
+
+def find_full_scan_reads(plan, tables):
+    """
+    Операторы TableFullScan по указанным таблицам и их индексам в плане запроса:
+    список (таблица, ReadLimit или None). ReadLimit означает, что чтение
+    останавливается после указанного числа строк
+    """
+    found = []
+    
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('Name') == 'TableFullScan':
+                table = scanned_table(node.get('Table', ''), tables)
+                if table:
+                    found.append((table, node.get('ReadLimit')))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+    
+    walk(plan)
+    return found
+
+def find_full_scans(plan, tables):
+    """Поиск операторов TableFullScan по указанным таблицам и их индексам в плане запроса"""
+    found = []
+    for table, _ in find_full_scan_reads(plan, tables):
+        if table not in found:
+            found.append(table)
+    return found
+
 class DatabaseManager:
     
     @staticmethod
-    def create_tables():
+    async def create_tables():
         """Создание всех таблиц в базе данных"""
         
         # Таблица пользователей
@@ -76,16 +290,22 @@ class DatabaseManager:
             title String NOT NULL,
             description String,
             company_id String NOT NULL,
+            company_name String,
             initiator_name String NOT NULL,
             initiator_phone String NOT NULL,
             assignee_id String NOT NULL,
             created_by String NOT NULL,
-            priority String NOT NULL,
+            priority String,
+            is_urgent Bool,
             status String,
             deadline Timestamp NOT NULL,
             created_at Timestamp,
             updated_at Timestamp,
-            PRIMARY KEY (task_id)
+            PRIMARY KEY (task_id),
+            INDEX idx_created_at GLOBAL ON (created_at),
+            INDEX idx_assignee_created GLOBAL ON (assignee_id, created_at),
+            INDEX idx_company_created GLOBAL ON (company_id, created_at),
+            INDEX idx_deadline GLOBAL ON (deadline)
         );
         """
         
@@ -97,7 +317,8 @@ class DatabaseManager:
             user_id String NOT NULL,
             comment_text String NOT NULL,
             created_at Timestamp,
-            PRIMARY KEY (comment_id)
+            PRIMARY KEY (comment_id),
+            INDEX idx_task_id GLOBAL ON (task_id)
         );
         """
         
@@ -113,7 +334,44 @@ class DatabaseManager:
             content_type String NOT NULL,
             thumbnail_path String,
             created_at Timestamp,
-            PRIMARY KEY (file_id)
+            PRIMARY KEY (file_id),
+            INDEX idx_task_id GLOBAL ON (task_id)
+        );
+        """
+        
+        # Счётчики задач по компании (assignee_id = '') и по исполнителю в
+        # компании с разбивкой по статусам; обновляются вместе с задачами
+        counters_query = """
+        CREATE TABLE task_counters (
+            assignee_id String NOT NULL,
+            company_id String NOT NULL,
+            status String NOT NULL,
+            task_count Int64,
+            PRIMARY KEY (assignee_id, company_id, status)
+        );
+        """
+        
+        # Состояния FSM; брошенные мастера удаляются через сутки
+        fsm_query = """
+        CREATE TABLE fsm_states (
+            storage_key String NOT NULL,
+            state String,
+            data String,
+            updated_at Timestamp,
+            PRIMARY KEY (storage_key)
+        ) WITH (
+            TTL = Interval("P1D") ON updated_at
+        );
+        """
+        
+        # Обработанные обновления Telegram (защита от повторной доставки)
+        processed_updates_query = """
+        CREATE TABLE processed_updates (
+            update_id Int64 NOT NULL,
+            processed_at Timestamp,
+            PRIMARY KEY (update_id)
+        ) WITH (
+            TTL = Interval("P1D") ON processed_at
         );
         """
         
@@ -122,56 +380,206 @@ class DatabaseManager:
             ("companies", companies_query),
             ("tasks", tasks_query),
             ("task_comments", comments_query),
-            ("task_files", files_query)
+            ("task_files", files_query),
+            ("task_counters", counters_query),
+            ("fsm_states", fsm_query),
+            ("processed_updates", processed_updates_query)
         ]
         
         for table_name, query in queries:
             try:
-                db_connection.execute_query(query)
-                print(f"Таблица {table_name} создана успешно")
+                await db_connection.execute_scheme(query)
+                logger.info(f"Таблица {table_name} создана успешно")
             except Exception as e:
-                if "already exists" in str(e):
-                    print(f"Таблица {table_name} уже существует")
+                if is_already_exists(e):
+                    logger.info(f"Таблица {table_name} уже существует")
                 else:
-                    print(f"Ошибка создания таблицы {table_name}: {e}")
+                    logger.error(f"Ошибка создания таблицы {table_name}: {e}")
                     raise e
+    
+    @staticmethod
+    async def create_indexes():
+        """Добавление вторичных индексов в уже созданные таблицы"""
+        for table_name, index_name, columns in SECONDARY_INDEXES:
+            query = f"ALTER TABLE {table_name} ADD INDEX {index_name} GLOBAL ON ({columns});"
+            try:
+                await db_connection.execute_scheme(query)
+                logger.info(f"Индекс {table_name}.{index_name} создан успешно")
+            except Exception as e:
+                if is_already_exists(e):
+                    logger.info(f"Индекс {table_name}.{index_name} уже существует")
+                else:
+                    logger.error(f"Ошибка создания индекса {table_name}.{index_name}: {e}")
+                    raise e
+    
+    @staticmethod
+    async def add_columns():
+        """Добавление новых колонок в уже созданные таблицы"""
+        for table_name, column_name, column_type in ADDED_COLUMNS:
+            query = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type};"
+            try:
+                await db_connection.execute_scheme(query)
+                logger.info(f"Колонка {table_name}.{column_name} добавлена успешно")
+            except Exception as e:
+                if is_already_exists(e):
+                    logger.info(f"Колонка {table_name}.{column_name} уже существует")
+                else:
+                    logger.error(f"Ошибка добавления колонки {table_name}.{column_name}: {e}")
+                    raise e
+    
+    @staticmethod
+    async def migrate():
+        """
+        Приведение существующей базы к текущей схеме. Шаги по порядку:
+        таблицы -> колонки -> индексы -> пересчёт счётчиков -> названия компаний.
+        Каждый шаг пропускает уже сделанное, повторный запуск безопасен.
+        Счётчики пересчитываются целиком: задачи, созданные во время пересчёта,
+        могут не попасть в них - тогда миграцию достаточно запустить ещё раз
+        """
+        await DatabaseManager.create_tables()
+        await DatabaseManager.add_columns()
+        await DatabaseManager.create_indexes()
+        
+        if not await DatabaseManager.rebuild_task_counters():
+            raise Exception("Не удалось пересчитать счётчики задач")
+        
+        fixed = await TaskManager.sync_company_names()
+        logger.info("Миграция базы данных завершена", extra={'company_names_fixed': fixed})
+        return {'company_names_fixed': fixed}
+    
+    @staticmethod
+    async def rebuild_task_counters():
+        """Пересчёт таблицы task_counters по существующим задачам"""
+        query = """
+        DELETE FROM task_counters;
+        
+        UPSERT INTO task_counters (assignee_id, company_id, status, task_count)
+        SELECT '' AS assignee_id, company_id, status, CAST(COUNT(*) AS Int64) AS task_count
+        FROM tasks
+        GROUP BY company_id, COALESCE(status, 'new') AS status;
+        
+        UPSERT INTO task_counters (assignee_id, company_id, status, task_count)
+        SELECT assignee_id, company_id, status, CAST(COUNT(*) AS Int64) AS task_count
+        FROM tasks
+        GROUP BY assignee_id, company_id, COALESCE(status, 'new') AS status;
+        """
+        
+        try:
+            await db_connection.execute_query(query, {})
+            logger.info("Счётчики задач пересчитаны")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка пересчёта счётчиков задач: {e}")
+            return False
+    
+    @staticmethod
+    def hot_queries():
+        """Частые запросы для проверки планов: [(название, текст запроса)]"""
+        queries = [("get_user_by_telegram_id", GET_USER_BY_TELEGRAM_ID_QUERY)]
+        
+        # Первая страница (без курсора) и следующие - для обеих ролей и фильтра по компании
+        for suffix, role, company_id in [('', 'admin', None),
+                                         ('_director', 'director', None),
+                                         ('_company', 'director', '-')]:
+            for page, cursor in [('_first', None), ('', '0_')]:
+                queries.append((f"get_user_tasks_page{suffix}{page}", TaskManager._tasks_page_query(
+                    '', role, cursor, 'next', TASKS_PAGE_SIZE, company_id=company_id
+                )[0]))
+        
+        # Текст подсчёта одинаков для всех ролей, различается только $assignee_id
+        queries += [
+            ("count_user_tasks", TaskManager._tasks_count_query('', 'director')[0]),
+            ("get_task_details", GET_TASK_DETAILS_QUERY)
+        ]
+        return queries
+    
+    @staticmethod
+    async def check_query_plans():
+        """
+        Проверка планов частых запросов.
+        Возвращает {название запроса: [таблицы, читаемые полным сканированием]},
+        пустой словарь - все запросы идут через ключи и индексы.
+        Известные чтения из KNOWN_FULL_SCANS не считаются регрессией,
+        если в плане есть ReadLimit, и выводятся в лог отдельно
+        """
+        regressions = {}
+        for name, query in DatabaseManager.hot_queries():
+            plan = json.loads(await db_connection.explain(query))
+            known = KNOWN_FULL_SCANS.get(name, ())
+            
+            tables = []
+            for table, read_limit in find_full_scan_reads(plan, INDEXED_TABLES):
+                if table in known and read_limit is not None:
+                    logger.info(f"Запрос {name}: известное чтение {table} целиком, ограничено {read_limit} строками")
+                elif table not in tables:
+                    tables.append(table)
+            
+            if tables:
+                logger.warning(f"Запрос {name} читает полным сканированием: {', '.join(tables)}")
+                regressions[name] = tables
+        
+        return regressions
+
+GET_USER_BY_TELEGRAM_ID_QUERY = """
+DECLARE $telegram_id AS Int64;
+
+SELECT user_id, telegram_id, username, first_name, last_name, role, created_at
+FROM users VIEW idx_telegram_id
+WHERE telegram_id = $telegram_id;
+"""
 
 class UserManager:
     
     @staticmethod
-    def create_user(telegram_id, username=None, first_name=None, last_name=None, role='admin'):
+    async def create_user(telegram_id, username=None, first_name=None, last_name=None, role='admin'):
         """Создание нового пользователя"""
         user_id = generate_uuid()
         current_time = get_current_time()
         
-        # Подготовка значений для вставки
-        username_val = f"'{username}'" if username else "NULL"
-        first_name_val = f"'{first_name}'" if first_name else "NULL"
-        last_name_val = f"'{last_name}'" if last_name else "NULL"
+        query = """
+        DECLARE $user_id AS String;
+        DECLARE $telegram_id AS Int64;
+        DECLARE $username AS String?;
+        DECLARE $first_name AS String?;
+        DECLARE $last_name AS String?;
+        DECLARE $role AS String;
+        DECLARE $created_at AS Timestamp;
         
-        query = f"""
         INSERT INTO users (user_id, telegram_id, username, first_name, last_name, role, created_at)
-        VALUES ('{user_id}', {telegram_id}, {username_val}, {first_name_val}, {last_name_val}, '{role}', Timestamp('{current_time.isoformat()}'));
+        VALUES ($user_id, $telegram_id, $username, $first_name, $last_name, $role, $created_at);
         """
         
+        parameters = {
+            '$user_id': to_bytes(user_id),
+            '$telegram_id': telegram_id,
+            '$username': to_bytes(username or None),
+            '$first_name': to_bytes(first_name or None),
+            '$last_name': to_bytes(last_name or None),
+            '$role': to_bytes(role),
+            '$created_at': to_timestamp(current_time.astimezone(timezone.utc))
+        }
+        
         try:
-            db_connection.execute_query(query)
+            await db_connection.execute_query(query, parameters)
+            _user_cache.pop(telegram_id)
             return user_id
         except Exception as e:
-            print(f"Ошибка создания пользователя: {e}")
+            logger.error(f"Ошибка создания пользователя: {e}")
             return None
     
     @staticmethod
-    def get_user_by_telegram_id(telegram_id):
+    async def get_user_by_telegram_id(telegram_id):
         """Получение пользователя по telegram_id"""
-        query = f"""
-        SELECT user_id, telegram_id, username, first_name, last_name, role, created_at
-        FROM users
-        WHERE telegram_id = {telegram_id};
-        """
+        cached_user = _user_cache.get(telegram_id)
+        if cached_user is not None:
+            return cached_user
         
         try:
-            result = db_connection.execute_query(query)
+            result = await db_connection.execute_query(
+                GET_USER_BY_TELEGRAM_ID_QUERY,
+                {'$telegram_id': telegram_id},
+                tx_mode='snapshot'
+            )
             if result[0].rows:
                 row = result[0].rows[0]
                 
@@ -181,7 +589,7 @@ class UserManager:
                         return value.decode('utf-8')
                     return value
                 
-                return {
+                user = {
                     'user_id': decode_if_bytes(row.user_id),
                     'telegram_id': row.telegram_id,
                     'username': decode_if_bytes(row.username),
@@ -190,43 +598,52 @@ class UserManager:
                     'role': decode_if_bytes(row.role),
                     'created_at': row.created_at
                 }
+                _user_cache.set(telegram_id, user)
+                return user
             return None
         except Exception as e:
-            print(f"Ошибка получения пользователя: {e}")
+            logger.error(f"Ошибка получения пользователя: {e}")
             return None
     
     @staticmethod
-    def get_users_count():
+    async def get_users_count():
         """Получение общего количества пользователей"""
         query = "SELECT COUNT(*) as count FROM users;"
         
         try:
-            result = db_connection.execute_query(query)
+            result = await db_connection.execute_query(query, {}, tx_mode='snapshot')
             if result[0].rows:
                 return result[0].rows[0].count
             return 0
         except Exception as e:
-            print(f"Ошибка получения количества пользователей: {e}")
+            logger.error(f"Ошибка получения количества пользователей: {e}")
             return 0
     
     @staticmethod
-    def update_user_role(user_id, new_role):
+    async def update_user_role(user_id, new_role):
         """Изменение роли пользователя"""
-        query = f"""
+        query = """
+        DECLARE $user_id AS String;
+        DECLARE $role AS String;
+        
         UPDATE users
-        SET role = '{new_role}'
-        WHERE user_id = '{user_id}';
+        SET role = $role
+        WHERE user_id = $user_id;
         """
         
         try:
-            db_connection.execute_query(query)
+            await db_connection.execute_query(query, {
+                '$user_id': to_bytes(user_id),
+                '$role': to_bytes(new_role)
+            })
+            _user_cache.pop_where(lambda user: user['user_id'] == user_id)
             return True
         except Exception as e:
-            print(f"Ошибка изменения роли пользователя: {e}")
+            logger.error(f"Ошибка изменения роли пользователя: {e}")
             return False
     
     @staticmethod
-    def get_assignees():
+    async def get_assignees():
         """Получение списка исполнителей (все роли могут быть исполнителями)"""
         query = """
         SELECT user_id, telegram_id, username, first_name, last_name, role
@@ -236,7 +653,8 @@ class UserManager:
         """
         
         try:
-            result = db_connection.execute_query(query)
+            # Справочные данные: небольшая задержка реплики допустима
+            result = await db_connection.execute_query(query, {}, tx_mode='stale')
             assignees = []
             
             if result[0].rows:
@@ -257,144 +675,270 @@ class UserManager:
             
             return assignees
         except Exception as e:
-            print(f"Ошибка получения исполнителей: {e}")
+            logger.error(f"Ошибка получения исполнителей: {e}")
             return []
 
+# Применение изменений $deltas (assignee_id, company_id, status, delta)
+# к счётчикам task_counters; вставляется в запрос после объявления $deltas
+UPSERT_TASK_COUNTERS = """
+UPSERT INTO task_counters (assignee_id, company_id, status, task_count)
+SELECT d.assignee_id AS assignee_id, d.company_id AS company_id, d.status AS status,
+       COALESCE(c.task_count, 0l) + d.delta AS task_count
+FROM $deltas AS d
+LEFT JOIN task_counters AS c
+    ON c.assignee_id = d.assignee_id AND c.company_id = d.company_id AND c.status = d.status;
+"""
+
 class TaskManager:    
 
     @staticmethod
-    def create_task(title, description, company_id, initiator_name, initiator_phone,
-                assignee_id, created_by, is_urgent, deadline):
-        """Создание новой задачи"""
+    async def create_task(title, description, company_id, initiator_name, initiator_phone,
+                assignee_id, created_by, is_urgent, deadline, company_name=None):
+        """
+        Создание новой задачи
+        company_name сохраняется в задаче, чтобы списки не соединялись с companies
+        """
         task_id = generate_uuid()
         current_time = get_current_time()
         
-        # Подготовка значений для вставки
-        description_val = f"'{description}'" if description else "NULL"
+        # Даты хранятся с точностью до секунды
+        deadline_ts = to_timestamp(deadline.replace(microsecond=0))
+        current_ts = to_timestamp(current_time.replace(microsecond=0))
         
-        # Форматируем даты в ISO формат для YDB
-        deadline_str = deadline.strftime('%Y-%m-%dT%H:%M:%SZ')
-        current_str = current_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+        query = """
+        DECLARE $task_id AS String;
+        DECLARE $title AS String;
+        DECLARE $description AS String?;
+        DECLARE $company_id AS String;
+        DECLARE $company_name AS String?;
+        DECLARE $initiator_name AS String;
+        DECLARE $initiator_phone AS String;
+        DECLARE $assignee_id AS String;
+        DECLARE $created_by AS String;
+        DECLARE $is_urgent AS Bool;
+        DECLARE $deadline AS Timestamp;
+        DECLARE $created_at AS Timestamp;
         
-        query = f"""
-        INSERT INTO tasks (task_id, title, description, company_id, initiator_name,
+        INSERT INTO tasks (task_id, title, description, company_id, company_name, initiator_name,
                         initiator_phone, assignee_id, created_by, is_urgent, status,
                         deadline, created_at, updated_at)
-        VALUES ('{task_id}', '{title}', {description_val}, '{company_id}',
-                '{initiator_name}', '{initiator_phone}', '{assignee_id}',
-                '{created_by}', {is_urgent}, 'new',
-                Timestamp('{deadline_str}'),
-                Timestamp('{current_str}'),
-                Timestamp('{current_str}'));
-        """
+        VALUES ($task_id, $title, $description, $company_id, $company_name,
+                $initiator_name, $initiator_phone, $assignee_id,
+                $created_by, $is_urgent, 'new',
+                $deadline, $created_at, $created_at);
+        
+        -- Счётчики обновляются в той же транзакции
+        $deltas = (
+            SELECT * FROM AS_TABLE(AsList(
+                AsStruct('' AS assignee_id, $company_id AS company_id, 'new' AS status, 1l AS delta),
+                AsStruct($assignee_id AS assignee_id, $company_id AS company_id, 'new' AS status, 1l AS delta)
+            ))
+        );
+        """ + UPSERT_TASK_COUNTERS
+        
+        parameters = {
+            '$task_id': to_bytes(task_id),
+            '$title': to_bytes(title),
+            '$description': to_bytes(description or None),
+            '$company_id': to_bytes(company_id),
+            '$company_name': to_bytes(company_name),
+            '$initiator_name': to_bytes(initiator_name),
+            '$initiator_phone': to_bytes(initiator_phone),
+            '$assignee_id': to_bytes(assignee_id),
+            '$created_by': to_bytes(created_by),
+            '$is_urgent': bool(is_urgent),
+            '$deadline': deadline_ts,
+            '$created_at': current_ts
+        }
         
         try:
-            db_connection.execute_query(query)
+            await db_connection.execute_query(query, parameters)
             return task_id
         except Exception as e:
-            print(f"Ошибка создания задачи: {e}")
+            logger.error(f"Ошибка создания задачи: {e}")
             return None
     @staticmethod
-    def get_user_tasks(user_id, role):
-        """Получение задач пользователя в зависимости от роли"""
-        if role in ['director', 'manager']:
-            query = """
-            SELECT t.task_id, t.title, t.description, t.is_urgent, t.status, t.deadline, t.created_at,
-                   c.name as company_name
-            FROM tasks AS t
-            INNER JOIN companies AS c ON t.company_id = c.company_id
-            ORDER BY t.created_at DESC;
-            """
-        else:
-            query = f"""
-            SELECT t.task_id, t.title, t.description, t.priority, t.status, t.deadline, t.created_at,
-                   c.name as company_name
-            FROM tasks AS t
-            INNER JOIN companies AS c ON t.company_id = c.company_id
-            WHERE t.assignee_id = '{user_id}'
-            ORDER BY t.created_at DESC;
-            """
+    def _tasks_filter(user_id, role, company_id=None, status=None):
+        """
+        Условия отбора задач: (DECLARE, условия WHERE, параметры, источник).
+        Источник - индекс, по префиксу которого читается выборка
+        """
+        declares = []
+        conditions = []
+        parameters = {}
+        source = "tasks VIEW idx_created_at"
+        
+        if company_id:
+            declares.append("DECLARE $company_id AS String;")
+            conditions.append("company_id = $company_id")
+            parameters['$company_id'] = to_bytes(company_id)
+            source = "tasks VIEW idx_company_created"
+        
+        if role not in ['director', 'manager']:
+            declares.append("DECLARE $user_id AS String;")
+            conditions.append("assignee_id = $user_id")
+            parameters['$user_id'] = to_bytes(user_id)
+            if not company_id:
+                source = "tasks VIEW idx_assignee_created"
+        
+        if status:
+            declares.append("DECLARE $status AS String;")
+            conditions.append("status = $status")
+            parameters['$status'] = to_bytes(status)
+        
+        return declares, conditions, parameters, source
+    
+    @staticmethod
+    def _tasks_page_query(user_id, role, cursor, direction, limit, company_id=None, status=None):
+        """
+        Построение запроса страницы задач по ключу (created_at, task_id).
+        В текст запроса подставляются только фиксированные фрагменты,
+        значения передаются параметрами
+        """
+        declares, conditions, parameters, source = TaskManager._tasks_filter(
+            user_id, role, company_id, status
+        )
+        declares.append("DECLARE $limit AS Uint64;")
+        parameters['$limit'] = limit + 1
+        
+        # next - более старые задачи, prev - более новые
+        compare = '<' if direction == 'next' else '>'
+        order = 'DESC' if direction == 'next' else 'ASC'
+        
+        if cursor:
+            cursor_created_at, cursor_task_id = decode_task_cursor(cursor)
+            declares.append("DECLARE $cursor_created_at AS Timestamp;")
+            declares.append("DECLARE $cursor_task_id AS String;")
+            conditions.append(
+                f"(created_at {compare} $cursor_created_at OR "
+                f"(created_at = $cursor_created_at AND task_id {compare} $cursor_task_id))"
+            )
+            parameters['$cursor_created_at'] = cursor_created_at
+            parameters['$cursor_task_id'] = to_bytes(cursor_task_id)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        declare_block = "\n        ".join(declares)
+        
+        query = f"""
+        {declare_block}
+        
+        SELECT task_id, title, description, is_urgent, status, deadline, created_at, company_name
+        FROM {source}
+        {where}
+        ORDER BY created_at {order}, task_id {order}
+        LIMIT $limit;
+        """
+        
+        return query, parameters
+    
+    @staticmethod
+    def _tasks_count_query(user_id, role, company_id=None, status=None):
+        """
+        Построение запроса количества задач с теми же условиями, что и у страницы.
+        Количество складывается из task_counters по префиксу первичного ключа,
+        поэтому не зависит от числа задач
+        """
+        # Для директора и менеджера - счётчики по компании целиком
+        assignee_id = '' if role in ['director', 'manager'] else user_id
+        
+        declares = ["DECLARE $assignee_id AS String;"]
+        conditions = ["assignee_id = $assignee_id"]
+        parameters = {'$assignee_id': to_bytes(assignee_id)}
+        
+        if company_id:
+            declares.append("DECLARE $company_id AS String;")
+            conditions.append("company_id = $company_id")
+            parameters['$company_id'] = to_bytes(company_id)
+        
+        if status:
+            declares.append("DECLARE $status AS String;")
+            conditions.append("status = $status")
+            parameters['$status'] = to_bytes(status)
+        
+        declare_block = "\n        ".join(declares)
+        
+        query = f"""
+        {declare_block}
+        
+        SELECT COALESCE(SUM(task_count), 0l) AS task_count
+        FROM task_counters
+        WHERE {' AND '.join(conditions)};
+        """
+        
+        return query, parameters
+    
+    @staticmethod
+    async def get_user_tasks_page(user_id, role, cursor=None, direction='next',
+                                  limit=TASKS_PAGE_SIZE, company_id=None, status=None):
+        """
+        Получение страницы задач пользователя в зависимости от роли.
+        cursor - курсор первой (direction='prev') или последней (direction='next')
+        задачи текущей страницы, None - первая страница.
+        company_id и status сужают выборку на стороне базы
+        """
+        query, parameters = TaskManager._tasks_page_query(
+            user_id, role, cursor, direction, limit, company_id, status
+        )
         
         try:
-            result = db_connection.execute_query(query)
-            tasks = []
-
-            status_emoji = {
-                'new': '🆕',
-                'in_progress': '⏳', 
-                'completed': '✅',
-                'overdue': '⚠️',
-                'cancelled': '❌'
-            }
+            result = await db_connection.execute_query(query, parameters, tx_mode='snapshot')
+            rows = list(result[0].rows)
             
-            if result[0].rows:
-                for row in result[0].rows:
-                    def decode_if_bytes(value):
-                        if isinstance(value, bytes):
-                            return value.decode('utf-8')
-                        return value
-                    
-                    deadline_str = parse_deadline(row['t.deadline'])
-                    
-                    # Форматируем для отображения в списке (только дата)
-                    try:
-                        if isinstance(row['t.deadline'], str) and 'T' in row['t.deadline']:
-                            deadline_dt = datetime.fromisoformat(row['t.deadline'].replace('Z', '+00:00'))
-                        elif isinstance(row['t.deadline'], int):
-                            deadline_timestamp = row['t.deadline'] / 1000000
-                            deadline_dt = datetime.fromtimestamp(deadline_timestamp)
-                        else:
-                            deadline_dt = row['t.deadline']
-                        
-                        deadline_short = deadline_dt.strftime('%d.%m')
-                    except:
-                        deadline_short = deadline_str
-                    
-                    tasks.append({
-                        'task_id': decode_if_bytes(row['t.task_id']),
-                        'title': decode_if_bytes(row['t.title']),
-                        'description': decode_if_bytes(row['t.description']),
-                        'is_urgent': row['t.is_urgent'],
-                        'deadline_short': deadline_short,
-                        'status': decode_if_bytes(row['t.status']),
-                        'deadline_str': deadline_str,
-                        'deadline_short': deadline_short,
-                        'created_at': row['t.created_at'],
-                        'deadline_short': deadline_short,
-                        'company_name': decode_if_bytes(row['company_name']),
-                        'status_emoji': status_emoji.get(decode_if_bytes(row['t.status']), '❓')
-                    })
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if direction == 'prev':
+                rows.reverse()
             
-            return tasks
+            return {
+                'tasks': [build_task_list_item(row) for row in rows],
+                'has_next': has_more if direction == 'next' else True,
+                'has_prev': bool(cursor) if direction == 'next' else has_more
+            }
         except Exception as e:
-            print(f"Ошибка получения задач: {e}")
-            return []
+            logger.error(f"Ошибка получения задач: {e}")
+            return {'tasks': [], 'has_next': False, 'has_prev': False}
+    
+    @staticmethod
+    async def count_user_tasks(user_id, role, company_id=None, status=None):
+        """Количество задач пользователя в зависимости от роли"""
+        query, parameters = TaskManager._tasks_count_query(user_id, role, company_id, status)
+        
+        try:
+            result = await db_connection.execute_query(query, parameters, tx_mode='snapshot')
+            if result[0].rows:
+                return result[0].rows[0].task_count
+            return 0
+        except Exception as e:
+            logger.error(f"Ошибка подсчета задач: {e}")
+            return 0
 
     @staticmethod
-    def get_companies_with_tasks(user_id, role):
+    async def get_companies_with_tasks(user_id, role):
         """Получение компаний с количеством задач"""
-        if role in ['director', 'manager']:
-            query = """
-            SELECT c.company_id, c.name, COUNT(t.task_id) as task_count
-            FROM companies c
-            LEFT JOIN tasks t ON c.company_id = t.company_id
-            GROUP BY c.company_id, c.name
-            HAVING task_count > 0
-            ORDER BY c.name;
-            """
-        else:
-            query = f"""
-            SELECT c.company_id, c.name, COUNT(t.task_id) as task_count
-            FROM companies c
-            LEFT JOIN tasks t ON c.company_id = t.company_id
-            WHERE t.assignee_id = '{user_id}'
-            GROUP BY c.company_id, c.name
-            HAVING task_count > 0
-            ORDER BY c.name;
-            """
+        # Счётчики читаются по префиксу первичного ключа task_counters
+        query = """
+        DECLARE $assignee_id AS String;
+        
+        $counts = (
+            SELECT company_id, SUM(task_count) AS task_count
+            FROM task_counters
+            WHERE assignee_id = $assignee_id
+            GROUP BY company_id
+        );
+        
+        SELECT c.company_id AS company_id, c.name AS name, n.task_count AS task_count
+        FROM $counts AS n
+        INNER JOIN companies AS c ON c.company_id = n.company_id
+        WHERE n.task_count > 0
+        ORDER BY name;
+        """
+        
+        # Для директора и менеджера - счётчики по компании целиком
+        assignee_id = '' if role in ['director', 'manager'] else user_id
+        parameters = {'$assignee_id': to_bytes(assignee_id)}
         
         try:
-            result = db_connection.execute_query(query)
+            result = await db_connection.execute_query(query, parameters, tx_mode='snapshot')
             companies = []
             
             if result[0].rows:
@@ -412,94 +956,172 @@ class TaskManager:
             
             return companies
         except Exception as e:
-            print(f"Ошибка получения компаний: {e}")
+            logger.error(f"Ошибка получения компаний: {e}")
             return []
 
     @staticmethod
-    def get_task_by_id(task_id):
-        """Получение подробной информации о задаче"""
-        query = f"""
-        SELECT t.task_id, t.title, t.description, t.is_urgent, t.status, t.deadline, t.created_at,
-               c.name as company_name, t.initiator_name, t.initiator_phone
-        FROM tasks AS t
-        INNER JOIN companies AS c ON t.company_id = c.company_id
-        WHERE t.task_id = '{task_id}';
+    async def get_task_details(task_id):
+        """
+        Задача и её файлы (с именами загрузивших) за один запрос:
+        два SELECT в одной транзакции - два набора результатов.
+        Возвращает (task, files) или (None, []), если задача не найдена.
+        Результат кэшируется до изменения статуса или загрузки файла
         """
+        cached = _task_details_cache.get(task_id)
+        if cached is not None:
+            return cached['task'], cached['files']
         
         try:
-            result = db_connection.execute_query(query)
-            if result[0].rows:
-                row = result[0].rows[0]
-                
-                def decode_if_bytes(value):
-                    if isinstance(value, bytes):
-                        return value.decode('utf-8')
-                    return value
-                
-                # Парсим дедлайн
-                deadline_str = parse_deadline(row['t.deadline'])
+            result = await db_connection.execute_query(
+                GET_TASK_DETAILS_QUERY,
+                {'$task_id': to_bytes(task_id)},
+                tx_mode='snapshot'
+            )
+            if not result[0].rows:
+                return None, []
+            
+            task = build_task_detail(result[0].rows[0])
+            files = [build_task_file(row) for row in result[1].rows]
+            
+            _task_details_cache.set(task_id, {
+                'task': task,
+                'files': files
+            })
+            return task, files
+        except Exception as e:
+            logger.error(f"Ошибка получения задачи с файлами: {e}")
+            return None, []
+
+    @staticmethod
+    def get_task_details_cache_stats(reset=False):
+        """Статистика кэша карточек задач (попадания, промахи, hit_rate)"""
+        return _task_details_cache.get_stats(reset=reset)
+
+    @staticmethod
+    async def sync_company_names(batch_size=500):
+        """
+        Фоновая синхронизация company_name в задачах с таблицей companies
+        (после переименования компаний и для задач, созданных до денормализации).
+        Возвращает количество исправленных задач
+        """
+        query = """
+        DECLARE $limit AS Uint64;
+        
+        $stale = (
+            SELECT t.task_id AS task_id, c.name AS company_name
+            FROM tasks AS t
+            INNER JOIN companies AS c ON t.company_id = c.company_id
+            WHERE t.company_name IS NULL OR t.company_name != c.name
+            LIMIT $limit
+        );
+        
+        SELECT COUNT(*) AS stale_count FROM $stale;
+        
+        UPDATE tasks ON
+        SELECT task_id, company_name FROM $stale;
+        """
+        
+        fixed = 0
+        try:
+            while True:
+                result = await db_connection.execute_query(query, {'$limit': batch_size})
+                stale_count = result[0].rows[0].stale_count if result[0].rows else 0
+                fixed += stale_count
                 
-                return {
-                    'task_id': decode_if_bytes(row['t.task_id']),
-                    'title': decode_if_bytes(row['t.title']),
-                    'description': decode_if_bytes(row['t.description']),
-                    'is_urgent': row['t.is_urgent'],
-                    'status': decode_if_bytes(row['t.status']),
-                    'deadline_str': parse_deadline(row['t.deadline']),
-                    'created_at': row['t.created_at'],
-                    'company_name': decode_if_bytes(row['company_name']),
-                    'initiator_name': decode_if_bytes(row['t.initiator_name']),
-                    'initiator_phone': decode_if_bytes(row['t.initiator_phone'])
-                }
-            return None
+                if stale_count < batch_size:
+                    break
+            
+            logger.info(f"Названия компаний обновлены в {fixed} задачах")
+            return fixed
         except Exception as e:
-            print(f"Ошибка получения задачи: {e}")
-            return None
+            logger.error(f"Ошибка синхронизации названий компаний: {e}")
+            return fixed
 
     @staticmethod
-    def update_task_status(task_id, new_status):
+    async def update_task_status(task_id, new_status):
         """Изменение статуса задачи"""
         current_time = get_current_time()
-        current_str = current_time.strftime('%Y-%m-%dT%H:%M:%SZ')
         
-        query = f"""
+        # Старый статус читается до записи, счётчики переносятся
+        # со старого статуса на новый в той же транзакции
+        query = """
+        DECLARE $task_id AS String;
+        DECLARE $status AS String;
+        DECLARE $updated_at AS Timestamp;
+        
+        $task = (
+            SELECT company_id, assignee_id, COALESCE(status, 'new') AS status
+            FROM tasks
+            WHERE task_id = $task_id
+        );
+        
+        $changes = (
+            SELECT '' AS assignee_id, company_id, status, -1l AS delta FROM $task
+            UNION ALL
+            SELECT assignee_id, company_id, status, -1l AS delta FROM $task
+            UNION ALL
+            SELECT '' AS assignee_id, company_id, $status AS status, 1l AS delta FROM $task
+            UNION ALL
+            SELECT assignee_id, company_id, $status AS status, 1l AS delta FROM $task
+        );
+        
+        $deltas = (
+            SELECT assignee_id, company_id, status, SUM(delta) AS delta
+            FROM $changes
+            GROUP BY assignee_id, company_id, status
+        );
+        """ + UPSERT_TASK_COUNTERS + """
         UPDATE tasks
-        SET status = '{new_status}', updated_at = Timestamp('{current_str}')
-        WHERE task_id = '{task_id}';
+        SET status = $status, updated_at = $updated_at
+        WHERE task_id = $task_id;
         """
         
         try:
-            db_connection.execute_query(query)
+            await db_connection.execute_query(query, {
+                '$task_id': to_bytes(task_id),
+                '$status': to_bytes(new_status),
+                '$updated_at': to_timestamp(current_time.replace(microsecond=0))
+            })
+            _task_details_cache.pop(task_id)
             return True
         except Exception as e:
-            print(f"Ошибка изменения статуса задачи: {e}")
+            logger.error(f"Ошибка изменения статуса задачи: {e}")
             return False
 
 class CompanyManager:
     
     @staticmethod
-    def create_company(name, description=None, created_by=None):
+    async def create_company(name, description=None, created_by=None):
         """Создание новой компании"""
         company_id = generate_uuid()
         current_time = get_current_time()
         
-        # Подготовка значений для вставки
-        description_val = f"'{description}'" if description else "NULL"
+        query = """
+        DECLARE $company_id AS String;
+        DECLARE $name AS String;
+        DECLARE $description AS String?;
+        DECLARE $created_by AS String;
+        DECLARE $created_at AS Timestamp;
         
-        query = f"""
         INSERT INTO companies (company_id, name, description, created_by, created_at)
-        VALUES ('{company_id}', '{name}', {description_val}, '{created_by}', Timestamp('{current_time.isoformat()}'));
+        VALUES ($company_id, $name, $description, $created_by, $created_at);
         """
         
         try:
-            db_connection.execute_query(query)
+            await db_connection.execute_query(query, {
+                '$company_id': to_bytes(company_id),
+                '$name': to_bytes(name),
+                '$description': to_bytes(description or None),
+                '$created_by': to_bytes(created_by),
+                '$created_at': to_timestamp(current_time.astimezone(timezone.utc))
+            })
             return company_id
         except Exception as e:
-            print(f"Ошибка создания компании: {e}")
+            logger.error(f"Ошибка создания компании: {e}")
             return None
     
     @staticmethod
-    def get_all_companies():
+    async def get_all_companies():
         """Получение всех компаний"""
         query = """
         SELECT company_id, name, description, created_by, created_at
@@ -508,7 +1130,8 @@ class CompanyManager:
         """
         
         try:
-            result = db_connection.execute_query(query)
+            # Справочные данные: небольшая задержка реплики допустима
+            result = await db_connection.execute_query(query, {}, tx_mode='stale')
             companies = []
             
             if result[0].rows:
@@ -529,20 +1152,26 @@ class CompanyManager:
             
             return companies
         except Exception as e:
-            print(f"Ошибка получения компаний: {e}")
+            logger.error(f"Ошибка получения компаний: {e}")
             return []
     
     @staticmethod
-    def get_company_by_id(company_id):
+    async def get_company_by_id(company_id):
         """Получение компании по ID"""
-        query = f"""
+        query = """
+        DECLARE $company_id AS String;
+        
         SELECT company_id, name, description, created_by, created_at
         FROM companies
-        WHERE company_id = '{company_id}';
+        WHERE company_id = $company_id;
         """
         
         try:
-            result = db_connection.execute_query(query)
+            result = await db_connection.execute_query(
+                query,
+                {'$company_id': to_bytes(company_id)},
+                tx_mode='snapshot'
+            )
             if result[0].rows:
                 row = result[0].rows[0]
                 
@@ -560,74 +1189,153 @@ class CompanyManager:
                 }
             return None
         except Exception as e:
-            print(f"Ошибка получения компании: {e}")
+            logger.error(f"Ошибка получения компании: {e}")
             return None
 
+# Карточка задачи: задача и файлы одним обращением к базе (два набора результатов)
+GET_TASK_DETAILS_QUERY = """
+DECLARE $task_id AS String;
+
+SELECT task_id, title, description, is_urgent, status, deadline, created_at,
+       company_name, initiator_name, initiator_phone
+FROM tasks
+WHERE task_id = $task_id;
+
+SELECT f.file_id, f.file_name, f.file_path, f.file_size, f.content_type, 
+   f.thumbnail_path, f.created_at,
+   u.first_name as first_name, u.last_name as last_name, u.username as username
+FROM task_files VIEW idx_task_id AS f
+JOIN users AS u ON f.user_id = u.user_id
+WHERE f.task_id = $task_id
+ORDER BY f.created_at DESC;
+"""
+
 class FileManager:
     
     @staticmethod
-    def save_file_info(task_id, user_id, file_id, file_name, file_path, file_size, content_type, thumbnail_path=None):
-        """Сохранение информации о файле в БД"""
+    async def save_files_info(task_id, user_id, files):
+        """
+        Сохранение нескольких файлов задачи одной транзакцией.
+        files - результаты FileStorage.upload_file/upload_stream
+        """
+        if not files:
+            return True
+        
         current_time = get_current_time()
+        created_at = to_timestamp(current_time.replace(microsecond=0))
         
-        # Подготовка значений для вставки
-        thumbnail_val = f"'{thumbnail_path}'" if thumbnail_path else "NULL"
+        query = """
+        DECLARE $files AS List<Struct<
+            file_id: String, task_id: String, user_id: String, file_name: String,
+            file_path: String, file_size: Int64, content_type: String,
+            thumbnail_path: String?, created_at: Timestamp
+        >>;
         
-        query = f"""
         INSERT INTO task_files (file_id, task_id, user_id, file_name, file_path, 
                                file_size, content_type, thumbnail_path, created_at)
-        VALUES ('{file_id}', '{task_id}', '{user_id}', '{file_name}', '{file_path}', 
-                {file_size}, '{content_type}', {thumbnail_val}, 
-                Timestamp('{current_time.strftime('%Y-%m-%dT%H:%M:%SZ')}'));
+        SELECT file_id, task_id, user_id, file_name, file_path,
+               file_size, content_type, thumbnail_path, created_at
+        FROM AS_TABLE($files);
         """
         
+        rows = [
+            {
+                'file_id': to_bytes(file['file_id']),
+                'task_id': to_bytes(task_id),
+                'user_id': to_bytes(user_id),
+                'file_name': to_bytes(file['original_name']),
+                'file_path': to_bytes(file['s3_key']),
+                'file_size': int(file['size']),
+                'content_type': to_bytes(file['content_type']),
+                'thumbnail_path': to_bytes(file['thumbnail_key'] or None),
+                'created_at': created_at
+            }
+            for file in files
+        ]
+        
         try:
-            db_connection.execute_query(query)
+            await db_connection.execute_query(query, {'$files': rows})
+            _task_details_cache.pop(task_id)
             return True
         except Exception as e:
-            print(f"Ошибка сохранения файла: {e}")
+            logger.error(f"Ошибка сохранения файлов: {e}")
             return False
     
     @staticmethod
-    def get_task_files(task_id):
-        """Получение всех файлов задачи"""
-        query = f"""
-        SELECT f.file_id, f.file_name, f.file_path, f.file_size, f.content_type, 
-           f.thumbnail_path, f.created_at,
-           u.first_name as first_name, u.last_name as last_name, u.username as username
-        FROM task_files f
-        JOIN users u ON f.user_id = u.user_id
-        WHERE f.task_id = '{task_id}'
-        ORDER BY f.created_at DESC;
+    async def update_thumbnail_path(task_id, file_id, thumbnail_path):
+        """Сохранение ключа превью, созданного при первом обращении"""
+        query = """
+        DECLARE $file_id AS String;
+        DECLARE $thumbnail_path AS String;
+        
+        UPDATE task_files
+        SET thumbnail_path = $thumbnail_path
+        WHERE file_id = $file_id;
         """
         
         try:
-            result = db_connection.execute_query(query)
-            files = []
-            
-            if result[0].rows:
-                for row in result[0].rows:
-                    def decode_if_bytes(value):
-                        if isinstance(value, bytes):
-                            return value.decode('utf-8')
-                        return value
-                    
-                    uploader_name = f"{decode_if_bytes(row.first_name) or ''} {decode_if_bytes(row.last_name) or ''}".strip()
-                    if not uploader_name:
-                        uploader_name = decode_if_bytes(row.username) or "Неизвестный"
-                    
-                    files.append({
-                        'file_id': decode_if_bytes(row.file_id),
-                        'file_name': decode_if_bytes(row.file_name),
-                        'file_path': decode_if_bytes(row.file_path),
-                        'file_size': row.file_size,
-                        'content_type': decode_if_bytes(row.content_type),
-                        'thumbnail_path': decode_if_bytes(row.thumbnail_path),
-                        'created_at': row.created_at,
-                        'uploader_name': uploader_name
-                    })
-            
-            return files
+            await db_connection.execute_query(query, {
+                '$file_id': to_bytes(file_id),
+                '$thumbnail_path': to_bytes(thumbnail_path)
+            })
+            _task_details_cache.pop(task_id)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения превью: {e}")
+            return False
+
+class UpdateManager:
+    
+    @staticmethod
+    async def claim_update(update_id):
+        """
+        Отметка обновления как обрабатываемого.
+        Возвращает False, если обновление уже обработано (повтор вебхука)
+        """
+        if _seen_updates.get(update_id):
+            return False
+        
+        # При одновременной отметке на двух экземплярах одна транзакция
+        # прерывается и повторяется, после чего видит существующую запись
+        query = """
+        DECLARE $update_id AS Int64;
+        DECLARE $processed_at AS Timestamp;
+        
+        SELECT COUNT(*) AS seen
+        FROM processed_updates
+        WHERE update_id = $update_id;
+        
+        UPSERT INTO processed_updates (update_id, processed_at)
+        VALUES ($update_id, $processed_at);
+        """
+        
+        try:
+            result = await db_connection.execute_query(query, {
+                '$update_id': update_id,
+                '$processed_at': to_timestamp(datetime.now(timezone.utc))
+            })
+            _seen_updates.set(update_id, True)
+            return result[0].rows[0].seen == 0
         except Exception as e:
-            print(f"Ошибка получения файлов: {e}")
-            return []
\ No newline at end of file
+            # Недоступность таблицы не должна останавливать обработку
+            logger.error(f"Ошибка отметки обновления {update_id}: {e}")
+            return True
+    
+    @staticmethod
+    async def release_update(update_id):
+        """Снятие отметки, чтобы повтор неудачно обработанного обновления прошёл"""
+        _seen_updates.pop(update_id)
+        
+        query = """
+        DECLARE $update_id AS Int64;
+        
+        DELETE FROM processed_updates
+        WHERE update_id = $update_id;
+        """
+        
+        try:
+            await db_connection.execute_query(query, {'$update_id': update_id})
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка снятия отметки обновления {update_id}: {e}")
+            return False
@@ -2,14 +2,17 @@ from aiogram import Dispatcher
 from aiogram.types import Message
 from aiogram import F
 from aiogram.fsm.context import FSMContext
-from database.models import UserManager, CompanyManager
+from database.models import CompanyManager
 from utils.keyboards import get_main_keyboard, get_company_management_keyboard, get_back_keyboard, get_skip_keyboard, clear_previous_messages
 from utils.states import CompanyStates
+from utils.logger import get_logger
 
-async def company_management_handler(message: Message):
+logger = get_logger(__name__)
+
+async def company_management_handler(message: Message, user=None):
     """Обработчик кнопки 'Управление компаниями'"""
     try:
-        print("=== Вызван company_management_handler ===")
+        logger.debug("=== Вызван company_management_handler ===")
         telegram_id = message.from_user.id
         
         # Очищаем чат
@@ -17,7 +20,6 @@ async def company_management_handler(message: Message):
         await clear_previous_messages(bot, telegram_id, 10)
         
         # Проверяем права пользователя
-        user = UserManager.get_user_by_telegram_id(telegram_id)
         if not user or user['role'] not in ['director', 'manager']:
             await message.answer(
                 "У вас нет прав для управления компаниями.",
@@ -31,24 +33,22 @@ async def company_management_handler(message: Message):
             reply_markup=get_company_management_keyboard()
         )
         
-        # Восстанавливаем нижнее меню
-        await message.answer(
+        # Восстанавливаем нижнее меню (последний ответ - в теле вебхука)
+        return message.answer(
             "Главное меню:",
             reply_markup=get_main_keyboard(user['role'])
         )
         
     except Exception as e:
-        print(f"Ошибка в company_management_handler: {e}")
+        logger.error(f"Ошибка в company_management_handler: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
-async def add_company_handler(message: Message, state: FSMContext):
+async def add_company_handler(message: Message, state: FSMContext, user=None):
     """Обработчик кнопки 'Добавить компанию'"""
     try:
-        print("=== Вызван add_company_handler ===")
-        telegram_id = message.from_user.id
+        logger.debug("=== Вызван add_company_handler ===")
         
         # Проверяем права пользователя
-        user = UserManager.get_user_by_telegram_id(telegram_id)
         if not user or user['role'] not in ['director', 'manager']:
             await message.answer("У вас нет прав для добавления компаний.")
             return
@@ -66,23 +66,21 @@ async def add_company_handler(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в add_company_handler: {e}")
+        logger.error(f"Ошибка в add_company_handler: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
-async def list_companies_handler(message: Message):
+async def list_companies_handler(message: Message, user=None):
     """Обработчик кнопки 'Список компаний'"""
     try:
-        print("=== Вызван list_companies_handler ===")
-        telegram_id = message.from_user.id
+        logger.debug("=== Вызван list_companies_handler ===")
         
         # Проверяем права пользователя
-        user = UserManager.get_user_by_telegram_id(telegram_id)
         if not user or user['role'] not in ['director', 'manager']:
             await message.answer("У вас нет прав для просмотра компаний.")
             return
         
         # Получаем список компаний
-        companies = CompanyManager.get_all_companies()
+        companies = await CompanyManager.get_all_companies()
         
         if not companies:
             await message.answer(
@@ -104,22 +102,18 @@ async def list_companies_handler(message: Message):
             )
         
     except Exception as e:
-        print(f"Ошибка в list_companies_handler: {e}")
+        logger.error(f"Ошибка в list_companies_handler: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
-async def back_to_main_handler(message: Message, state: FSMContext):
+async def back_to_main_handler(message: Message, state: FSMContext, user=None):
     """Обработчик кнопки 'Назад' - возврат в главное меню"""
     try:
-        print("=== Вызван back_to_main_handler ===")
+        logger.debug("=== Вызван back_to_main_handler ===")
         
         # Очищаем состояние
         await state.clear()
         
-        telegram_id = message.from_user.id
-
-       
-        # Получаем пользователя для определения роли
-        user = UserManager.get_user_by_telegram_id(telegram_id)
+        # Роль пользователя для главного меню
         role = user['role'] if user else 'admin'
         
         if role == 'director':
@@ -136,13 +130,13 @@ async def back_to_main_handler(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в back_to_main_handler: {e}")
+        logger.error(f"Ошибка в back_to_main_handler: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_company_name(message: Message, state: FSMContext):
     """Обработчик ввода названия компании"""
     try:
-        print("=== Вызван process_company_name ===")
+        logger.debug("=== Вызван process_company_name ===")
         
         # Проверяем корректность названия
         company_name = message.text.strip()
@@ -176,13 +170,13 @@ async def process_company_name(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_company_name: {e}")
+        logger.error(f"Ошибка в process_company_name: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_company_description(message: Message, state: FSMContext):
     """Обработчик ввода описания компании"""
     try:
-        print("=== Вызван process_company_description ===")
+        logger.debug("=== Вызван process_company_description ===")
         
         # Получаем данные из состояния
         data = await state.get_data()
@@ -201,7 +195,7 @@ async def process_company_description(message: Message, state: FSMContext):
                 return
         
         # Создаем компанию
-        company_id = CompanyManager.create_company(
+        company_id = await CompanyManager.create_company(
             name=company_name,
             description=description,
             created_by=created_by
@@ -227,7 +221,7 @@ async def process_company_description(message: Message, state: FSMContext):
             )
         
     except Exception as e:
-        print(f"Ошибка в process_company_description: {e}")
+        logger.error(f"Ошибка в process_company_description: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def skip_description_handler(message: Message, state: FSMContext):
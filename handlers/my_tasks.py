@@ -1,32 +1,143 @@
+import asyncio
 from aiogram import Dispatcher
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaPhoto
 from aiogram import F
-from database.models import UserManager, TaskManager, FileManager
+from aiogram.fsm.context import FSMContext
+from database.models import TaskManager, FileManager, encode_task_cursor
 from utils.keyboards import get_main_keyboard, clear_previous_messages
-from utils.file_storage import file_storage
+from utils.file_storage import get_file_storage
 from datetime import datetime
+from utils.logger import get_logger
 
+logger = get_logger(__name__)
 
-async def my_tasks_handler(message: Message):
+
+# Названия статусов для списка задач
+STATUS_NAMES = {
+    'new': 'Новая',
+    'in_progress': 'В процессе', 
+    'completed': 'Выполнена',
+    'overdue': 'Просрочена',
+    'cancelled': 'Отменена'
+}
+
+async def get_company_filter(state: FSMContext):
+    """Текущий фильтр списка задач по компании (None - все компании)"""
+    data = await state.get_data()
+    return data.get('tasks_company_id')
+
+async def get_file_thumbnail(task_id, file):
+    """
+    Ключ превью файла задачи. Превью создается при первом обращении,
+    сохраняется в S3, а ключ - в task_files.thumbnail_path.
+    None, если файл не изображение или превью создать не удалось
+    """
+    if file['thumbnail_path']:
+        return file['thumbnail_path']
+
+    file_storage = get_file_storage()
+    if not file_storage.is_image(file['content_type']):
+        return None
+
+    try:
+        thumbnail_path = await file_storage.get_or_create_thumbnail(file['file_path'])
+    except Exception as e:
+        logger.error(f"Ошибка получения превью: {e}")
+        return None
+
+    if thumbnail_path:
+        await FileManager.update_thumbnail_path(task_id, file['file_id'], thumbnail_path)
+        file['thumbnail_path'] = thumbnail_path
+    return thumbnail_path
+
+async def build_tasks_list(user, cursor=None, direction='next', refreshed_at=None, company_id=None):
+    """
+    Формирование страницы списка задач
+    Возвращает (текст, клавиатура) или None, если задач нет
+    """
+    page, total = await asyncio.gather(
+        TaskManager.get_user_tasks_page(
+            user['user_id'], user['role'], cursor, direction, company_id=company_id
+        ),
+        TaskManager.count_user_tasks(user['user_id'], user['role'], company_id=company_id)
+    )
+    tasks = page['tasks']
+    
+    if not tasks:
+        return None
+    
+    # Формируем кнопки управления
+    control_buttons = [
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_tasks"),
+         InlineKeyboardButton(text="🏢 Фильтр по компаниям", callback_data="filter_companies")]
+    ]
+    if company_id:
+        control_buttons.append(
+            [InlineKeyboardButton(text="❌ Сбросить фильтр", callback_data="reset_company_filter")]
+        )
+    
+    # Формируем кнопки с задачами
+    task_buttons = []
+    for task in tasks:
+        # Формируем текст кнопки
+        urgent_emoji = "🔥" if task.get('is_urgent', False) else ""
+        status_name = STATUS_NAMES.get(task['status'], task['status'])
+        button_text = f"{task['status_emoji']}{urgent_emoji} {status_name} | {task['title'][:25]}... | {task['company_name']} | {task.get('deadline_short', '')}"
+        
+        task_buttons.append([InlineKeyboardButton(
+            text=button_text,
+            callback_data=f"task_{task['task_id']}"
+        )])
+    
+    # Кнопки перехода между страницами
+    navigation = []
+    if page['has_prev']:
+        navigation.append(InlineKeyboardButton(
+            text="◀ Предыдущие",
+            callback_data=f"tp_p_{encode_task_cursor(tasks[0])}"
+        ))
+    if page['has_next']:
+        navigation.append(InlineKeyboardButton(
+            text="Следующие ▶",
+            callback_data=f"tp_n_{encode_task_cursor(tasks[-1])}"
+        ))
+    
+    keyboard = control_buttons + task_buttons
+    if navigation:
+        keyboard.append(navigation)
+    
+    if company_id:
+        tasks_text = f"📝 Задачи компании {tasks[0]['company_name']} ({total})"
+    else:
+        tasks_text = f"📝 Ваши задачи ({total})"
+    if refreshed_at:
+        tasks_text += f" - обновлено {refreshed_at}"
+    tasks_text += ":"
+    
+    return tasks_text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def my_tasks_handler(message: Message, state: FSMContext, user=None):
     """Обработчик кнопки 'Мои задачи'"""
     try:
-        print("=== Вызван my_tasks_handler ===")
+        logger.debug("=== Вызван my_tasks_handler ===")
         telegram_id = message.from_user.id
         
         # Очищаем чат
         from main import bot
         await clear_previous_messages(bot, telegram_id, 10)
         
-        # Получаем пользователя
-        user = UserManager.get_user_by_telegram_id(telegram_id)
         if not user:
             await message.answer("Пользователь не найден.")
             return
         
-        # Получаем задачи пользователя
-        tasks = TaskManager.get_user_tasks(user['user_id'], user['role'])
+        # Открытие из меню всегда показывает все компании
+        if await get_company_filter(state):
+            await state.update_data(tasks_company_id=None)
+        
+        # Получаем первую страницу задач пользователя
+        tasks_list = await build_tasks_list(user)
         
-        if not tasks:
+        if not tasks_list:
             await message.answer(
                 "📝 У вас пока нет задач",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[])
@@ -38,44 +149,12 @@ async def my_tasks_handler(message: Message):
             )
             return
         
-        # Формируем кнопки управления
-        control_buttons = [
-            [InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_tasks"),
-             InlineKeyboardButton(text="🏢 Фильтр по компаниям", callback_data="filter_companies")]
-        ]
-        
-        # Формируем кнопки с задачами
-        task_buttons = []
-        for task in tasks[:15]:  # Показываем первые 15 задач
-            # Формируем текст кнопки
-            urgent_emoji = "🔥" if task.get('is_urgent', False) else ""
-            status_names = {
-                'new': 'Новая',
-                'in_progress': 'В процессе', 
-                'completed': 'Выполнена',
-                'overdue': 'Просрочена',
-                'cancelled': 'Отменена'
-            }
-            
-            status_name = status_names.get(task['status'], task['status'])
-            button_text = f"{task['status_emoji']}{urgent_emoji} {status_name} | {task['title'][:25]}... | {task['company_name']} | {task.get('deadline_short', '')}"
-            
-            task_buttons.append([InlineKeyboardButton(
-                text=button_text,
-                callback_data=f"task_{task['task_id']}"
-            )])
-        
-        # Объединяем все кнопки
-        keyboard = control_buttons + task_buttons
-        
-        tasks_text = f"📝 Ваши задачи ({len(tasks)}):"
-        if len(tasks) > 15:
-            tasks_text += f"\n\nПоказано первые 15 из {len(tasks)} задач"
+        tasks_text, keyboard = tasks_list
         
         # Отправляем список
         await message.answer(
             tasks_text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+            reply_markup=keyboard
         )
         
         # Восстанавливаем нижнее меню
@@ -85,10 +164,10 @@ async def my_tasks_handler(message: Message):
         )
         
     except Exception as e:
-        print(f"Ошибка в my_tasks_handler: {e}")
+        logger.error(f"Ошибка в my_tasks_handler: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
-async def process_task_callback(callback: CallbackQuery):
+async def process_task_callback(callback: CallbackQuery, state: FSMContext, user=None):
     """Обработчик нажатий на задачи"""
     try:
         data = callback.data
@@ -96,15 +175,12 @@ async def process_task_callback(callback: CallbackQuery):
         if data.startswith("task_"):
             task_id = data.replace("task_", "")
             
-            # Получаем детали задачи
-            task = TaskManager.get_task_by_id(task_id)
+            # Задача и файлы одним запросом
+            task, files = await TaskManager.get_task_details(task_id)
             if not task:
                 await callback.answer("Задача не найдена")
                 return
             
-            # Получаем файлы задачи
-            files = FileManager.get_task_files(task_id)
-            
             # Формируем детальное описание
             detail_text = f"📋 {task['title']}\n\n"
             detail_text += f"📝 Описание: {task['description']}\n"
@@ -120,18 +196,26 @@ async def process_task_callback(callback: CallbackQuery):
                 for file in files:
                     detail_text += f"• {file['file_name']}\n"
             
+            keyboard = []
+            
+            # Превью создаются только по запросу - карточка открывается без них
+            file_storage = get_file_storage()
+            if any(file_storage.is_image(file['content_type']) for file in files):
+                keyboard.append([InlineKeyboardButton(
+                    text="🖼 Превью изображений",
+                    callback_data=f"previews_{task_id}"
+                )])
+            
+            keyboard.append([InlineKeyboardButton(text="🔙 Назад к списку", callback_data="back_to_tasks")])
+            
             await callback.message.edit_text(
                 detail_text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="🔙 Назад к списку", callback_data="back_to_tasks")]
-                ])
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
             )
             
         elif data == "filter_companies":
             # Показываем фильтр по компаниям
-            telegram_id = callback.from_user.id
-            user = UserManager.get_user_by_telegram_id(telegram_id)
-            companies = TaskManager.get_companies_with_tasks(user['user_id'], user['role'])
+            companies = await TaskManager.get_companies_with_tasks(user['user_id'], user['role'])
             
             keyboard = []
             for company in companies:
@@ -147,106 +231,117 @@ async def process_task_callback(callback: CallbackQuery):
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
             )
             
+        elif data.startswith("company_") or data == "reset_company_filter":
+            # Выбор или сброс фильтра - отбор выполняется запросом к базе
+            company_id = data.replace("company_", "", 1) if data.startswith("company_") else None
+            await state.update_data(tasks_company_id=company_id)
+            
+            tasks_list = await build_tasks_list(user, company_id=company_id)
+            
+            if not tasks_list:
+                await callback.message.edit_text(
+                    "📝 Задач по выбранной компании нет",
+                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                        [InlineKeyboardButton(text="🔙 Назад", callback_data="reset_company_filter")]
+                    ])
+                )
+                return
+            
+            tasks_text, keyboard = tasks_list
+            await callback.message.edit_text(
+                tasks_text,
+                reply_markup=keyboard
+            )
+            
         elif data == "back_to_tasks":
             # Возвращаемся к списку задач
-            telegram_id = callback.from_user.id
-            user = UserManager.get_user_by_telegram_id(telegram_id)
-            tasks = TaskManager.get_user_tasks(user['user_id'], user['role'])
+            tasks_list = await build_tasks_list(user, company_id=await get_company_filter(state))
             
-            if not tasks:
+            if not tasks_list:
                 await callback.message.edit_text("📝 У вас пока нет задач")
                 return
             
-            # Формируем кнопки как в основном обработчике
-            control_buttons = [
-                [InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_tasks"),
-                 InlineKeyboardButton(text="🏢 Фильтр по компаниям", callback_data="filter_companies")]
-            ]
-            
-            task_buttons = []
-            for task in tasks[:15]:
-                urgent_emoji = "🔥" if task.get('is_urgent', False) else ""
-                status_names = {
-                    'new': 'Новая',
-                    'in_progress': 'В процессе', 
-                    'completed': 'Выполнена',
-                    'overdue': 'Просрочена',
-                    'cancelled': 'Отменена'
-                }
-                
-                status_name = status_names.get(task['status'], task['status'])
-                button_text = f"{task['status_emoji']}{urgent_emoji} {status_name} | {task['title'][:25]}... | {task['company_name']} | {task.get('deadline_short', '')}"
-                
-                task_buttons.append([InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=f"task_{task['task_id']}"
-                )])
-            
-            keyboard = control_buttons + task_buttons
+            tasks_text, keyboard = tasks_list
+            await callback.message.edit_text(
+                tasks_text,
+                reply_markup=keyboard
+            )
+
+        elif data.startswith("tp_"):
+            # Переход на соседнюю страницу списка
+            _, direction, cursor = data.split("_", 2)
+            tasks_list = await build_tasks_list(
+                user,
+                cursor=cursor,
+                direction='prev' if direction == 'p' else 'next',
+                company_id=await get_company_filter(state)
+            )
             
-            tasks_text = f"📝 Ваши задачи ({len(tasks)}):"
-            if len(tasks) > 15:
-                tasks_text += f"\n\nПоказано первые 15 из {len(tasks)} задач"
+            if not tasks_list:
+                await callback.answer("Больше задач нет")
+                return
             
+            tasks_text, keyboard = tasks_list
             await callback.message.edit_text(
                 tasks_text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+                reply_markup=keyboard
             )
 
         elif data == "refresh_tasks":
             # Получаем обновленный список задач
-            telegram_id = callback.from_user.id
-            user = UserManager.get_user_by_telegram_id(telegram_id)
-            tasks = TaskManager.get_user_tasks(user['user_id'], user['role'])
+            current_time = datetime.now().strftime("%H:%M:%S")
+            tasks_list = await build_tasks_list(
+                user,
+                refreshed_at=current_time,
+                company_id=await get_company_filter(state)
+            )
             
-            if not tasks:
+            if not tasks_list:
                 await callback.message.edit_text("📝 У вас пока нет задач")
                 await callback.answer("Список обновлен")
                 return
             
-            # Формируем новые кнопки
-            control_buttons = [
-                [InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_tasks"),
-                 InlineKeyboardButton(text="🏢 Фильтр по компаниям", callback_data="filter_companies")]
-            ]
-            
-            task_buttons = []
-            for task in tasks[:15]:
-                urgent_emoji = "🔥" if task.get('is_urgent', False) else ""
-                status_names = {
-                    'new': 'Новая',
-                    'in_progress': 'В процессе', 
-                    'completed': 'Выполнена',
-                    'overdue': 'Просрочена',
-                    'cancelled': 'Отменена'
-                }
-                
-                status_name = status_names.get(task['status'], task['status'])
-                button_text = f"{task['status_emoji']}{urgent_emoji} {status_name} | {task['title'][:25]}... | {task['company_name']} | {task.get('deadline_short', '')}"
-                
-                task_buttons.append([InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=f"task_{task['task_id']}"
-                )])
-            
-            keyboard = control_buttons + task_buttons
-            
-            # Добавляем временную метку
-            from datetime import datetime
-            current_time = datetime.now().strftime("%H:%M:%S")
-            tasks_text = f"📝 Ваши задачи ({len(tasks)}) - обновлено {current_time}"
-            if len(tasks) > 15:
-                tasks_text += f"\n\nПоказано первые 15 из {len(tasks)} задач"
-            
+            tasks_text, keyboard = tasks_list
             await callback.message.edit_text(
                 tasks_text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+                reply_markup=keyboard
             )
             
             await callback.answer("✅ Список обновлен")
         await callback.answer()
     except Exception as e:
-        print(f"Ошибка в process_task_callback: {e}")
+        logger.error(f"Ошибка в process_task_callback: {e}")
+        await callback.answer("Произошла ошибка")
+
+async def task_previews_callback(callback: CallbackQuery, user=None):
+    """Отправка превью изображений задачи (создаются при первом запросе)"""
+    try:
+        task_id = callback.data.replace("previews_", "")
+        
+        task, files = await TaskManager.get_task_details(task_id)
+        if not task:
+            await callback.answer("Задача не найдена")
+            return
+        
+        # В альбоме Telegram не больше 10 фотографий
+        file_storage = get_file_storage()
+        images = [file for file in files if file_storage.is_image(file['content_type'])][:10]
+        
+        thumbnail_paths = await asyncio.gather(*(get_file_thumbnail(task_id, file) for file in images))
+        urls = await asyncio.gather(*(
+            file_storage.get_file_url(thumbnail_path)
+            for thumbnail_path in thumbnail_paths if thumbnail_path
+        ))
+        
+        media = [InputMediaPhoto(media=url) for url in urls if url]
+        if not media:
+            await callback.answer("Не удалось подготовить превью")
+            return
+        
+        await callback.message.answer_media_group(media)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в task_previews_callback: {e}")
         await callback.answer("Произошла ошибка")
 
 def register_my_tasks_handlers(dp: Dispatcher):
@@ -256,4 +351,7 @@ def register_my_tasks_handlers(dp: Dispatcher):
     dp.callback_query.register(process_task_callback, F.data == "filter_companies")
     dp.callback_query.register(process_task_callback, F.data == "back_to_tasks")
     dp.callback_query.register(process_task_callback, F.data.startswith("company_"))
-    dp.callback_query.register(process_task_callback, F.data == "refresh_tasks")
\ No newline at end of file
+    dp.callback_query.register(process_task_callback, F.data == "refresh_tasks")
+    dp.callback_query.register(process_task_callback, F.data.startswith("tp_"))
+    dp.callback_query.register(process_task_callback, F.data == "reset_company_filter")
+    dp.callback_query.register(task_previews_callback, F.data.startswith("previews_"))
\ No newline at end of file
@@ -3,29 +3,32 @@ from aiogram.types import Message
 from aiogram.filters import Command
 from database.models import UserManager
 from utils.keyboards import get_main_keyboard
+from utils.logger import get_logger
 
+logger = get_logger(__name__)
 
-async def start_command(message: Message):
+
+async def start_command(message: Message, user=None):
     """Обработчик команды /start"""
     try:
-        print("=== Вызван start_command ===")
+        logger.debug("=== Вызван start_command ===")
         telegram_id = message.from_user.id
 
         username = message.from_user.username
         first_name = message.from_user.first_name
         last_name = message.from_user.last_name
         
-        print(f"Данные пользователя: ID={telegram_id}, username={username}, name={first_name} {last_name}")
+        logger.debug(f"Данные пользователя: ID={telegram_id}, username={username}, name={first_name} {last_name}")
         
         # Проверяем, существует ли пользователь
-        print("Проверяем существование пользователя...")
-        existing_user = UserManager.get_user_by_telegram_id(telegram_id)
-        print(f"Результат поиска пользователя: {existing_user}")
+        logger.debug("Проверяем существование пользователя...")
+        existing_user = user
+        logger.debug(f"Результат поиска пользователя: {existing_user}")
         
         if existing_user:
             # Пользователь уже существует
             role = existing_user['role']
-            print(f"Пользователь найден с ролью: {role}")
+            logger.debug(f"Пользователь найден с ролью: {role}")
             
             if role == 'director':
                 role_text = "Директор"
@@ -35,17 +38,18 @@ async def start_command(message: Message):
                 role_text = "Системный администратор"
             
             response_text = f"Добро пожаловать обратно!\nВаша роль: {role_text}"
-            print(f"Отправляем ответ: {response_text}")
+            logger.debug(f"Отправляем ответ: {response_text}")
             
-            await message.answer(
+            # Единственный ответ возвращается в теле вебхука
+            return message.answer(
                 response_text,
                 reply_markup=get_main_keyboard(role)
             )
         else:
-            print("Пользователь не найден, создаем нового...")
+            logger.debug("Пользователь не найден, создаем нового...")
             # Создаем нового пользователя
-            users_count = UserManager.get_users_count()
-            print(f"Общее количество пользователей: {users_count}")
+            users_count = await UserManager.get_users_count()
+            logger.debug(f"Общее количество пользователей: {users_count}")
             
             # Первый пользователь становится директором
             if users_count == 0:
@@ -72,11 +76,11 @@ async def start_command(message: Message):
                     f"• Добавлять комментарии к задачам"
                 )
             
-            print(f"Назначенная роль: {role}")
+            logger.debug(f"Назначенная роль: {role}")
             
             # Создаем пользователя в базе
-            print("Создаем пользователя в базе данных...")
-            user_id = UserManager.create_user(
+            logger.debug("Создаем пользователя в базе данных...")
+            user_id = await UserManager.create_user(
                 telegram_id=telegram_id,
                 username=username,
                 first_name=first_name,
@@ -84,26 +88,24 @@ async def start_command(message: Message):
                 role=role
             )
             
-            print(f"Результат создания пользователя: {user_id}")
+            logger.debug(f"Результат создания пользователя: {user_id}")
             
             if user_id:
-                print(f"Отправляем приветственное сообщение: {welcome_text}")
-                await message.answer(
+                logger.debug(f"Отправляем приветственное сообщение: {welcome_text}")
+                return message.answer(
                     welcome_text,
                     reply_markup=get_main_keyboard(role)
                 )
             else:
-                print("Ошибка создания пользователя, отправляем сообщение об ошибке")
+                logger.error("Ошибка создания пользователя, отправляем сообщение об ошибке")
                 await message.answer(
                     "Произошла ошибка при регистрации. Попробуйте позже."
                 )
         
-        print("=== start_command завершен ===")
+        logger.debug("=== start_command завершен ===")
                 
     except Exception as e:
-        print(f"Ошибка в start_command: {e}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception(f"Ошибка в start_command: {e}")
         await message.answer(
             "Произошла ошибка. Попробуйте позже."
         )
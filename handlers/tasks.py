@@ -8,13 +8,18 @@ from utils.states import TaskStates
 from datetime import datetime, timedelta
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 import calendar
-from utils.file_storage import file_storage
+import asyncio
+import time
+from utils.file_storage import get_file_storage
 from database.models import UserManager, CompanyManager, TaskManager, FileManager
+from utils.logger import get_logger
 
-async def create_task_handler(message: Message, state: FSMContext):
+logger = get_logger(__name__)
+
+async def create_task_handler(message: Message, state: FSMContext, user=None):
     """Обработчик кнопки 'Создать задачу'"""
     try:
-        print("=== Вызван create_task_handler ===")
+        logger.debug("=== Вызван create_task_handler ===")
         telegram_id = message.from_user.id
         
         # Очищаем чат
@@ -22,7 +27,6 @@ async def create_task_handler(message: Message, state: FSMContext):
         await clear_previous_messages(bot, telegram_id, 10)
         
         # Проверяем права пользователя
-        user = UserManager.get_user_by_telegram_id(telegram_id)
         if not user or user['role'] not in ['director', 'manager']:
             await message.answer(
                 "У вас нет прав для создания задач.",
@@ -49,13 +53,13 @@ async def create_task_handler(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в create_task_handler: {e}")
+        logger.error(f"Ошибка в create_task_handler: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_task_title(message: Message, state: FSMContext):
     """Обработчик ввода названия задачи"""
     try:
-        print("=== Вызван process_task_title ===")
+        logger.debug("=== Вызван process_task_title ===")
         
         # Проверяем корректность названия
         task_title = message.text.strip()
@@ -88,13 +92,13 @@ async def process_task_title(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_task_title: {e}")
+        logger.error(f"Ошибка в process_task_title: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_task_description(message: Message, state: FSMContext):
     """Обработчик ввода описания задачи (текст или файлы)"""
     try:
-        print("=== Вызван process_task_description ===")
+        logger.debug("=== Вызван process_task_description ===")
         
         task_description = ""
         task_files = []
@@ -172,7 +176,7 @@ async def process_task_description(message: Message, state: FSMContext):
         )
         
         # Получаем список компаний для выбора
-        companies = CompanyManager.get_all_companies()
+        companies = await CompanyManager.get_all_companies()
         
         if not companies:
             await message.answer(
@@ -205,16 +209,16 @@ async def process_task_description(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_task_description: {e}")
+        logger.error(f"Ошибка в process_task_description: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_company_selection(message: Message, state: FSMContext):
     """Обработчик выбора компании"""
     try:
-        print("=== Вызван process_company_selection ===")
+        logger.debug("=== Вызван process_company_selection ===")
         
         # Получаем список компаний
-        companies = CompanyManager.get_all_companies()
+        companies = await CompanyManager.get_all_companies()
         selected_company = None
         
         # Ищем выбранную компанию
@@ -246,13 +250,13 @@ async def process_company_selection(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_company_selection: {e}")
+        logger.error(f"Ошибка в process_company_selection: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_initiator_name(message: Message, state: FSMContext):
     """Обработчик ввода имени инициатора"""
     try:
-        print("=== Вызван process_initiator_name ===")
+        logger.debug("=== Вызван process_initiator_name ===")
         
         initiator_name = message.text.strip()
         if len(initiator_name) < 2:
@@ -284,13 +288,13 @@ async def process_initiator_name(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_initiator_name: {e}")
+        logger.error(f"Ошибка в process_initiator_name: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_initiator_phone(message: Message, state: FSMContext):
     """Обработчик ввода телефона инициатора"""
     try:
-        print("=== Вызван process_initiator_phone ===")
+        logger.debug("=== Вызван process_initiator_phone ===")
         
         phone = message.text.strip()
         
@@ -315,7 +319,7 @@ async def process_initiator_phone(message: Message, state: FSMContext):
         await state.update_data(initiator_phone=phone)
         
         # Получаем список исполнителей
-        assignees = UserManager.get_assignees()
+        assignees = await UserManager.get_assignees()
         
         if not assignees:
             await message.answer(
@@ -347,16 +351,16 @@ async def process_initiator_phone(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_initiator_phone: {e}")
+        logger.error(f"Ошибка в process_initiator_phone: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_assignee_selection(message: Message, state: FSMContext):
     """Обработчик выбора исполнителя"""
     try:
-        print("=== Вызван process_assignee_selection ===")
+        logger.debug("=== Вызван process_assignee_selection ===")
         
         # Получаем список исполнителей
-        assignees = UserManager.get_assignees()
+        assignees = await UserManager.get_assignees()
         selected_assignee = None
         
         # Ищем выбранного исполнителя по имени
@@ -392,13 +396,13 @@ async def process_assignee_selection(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_assignee_selection: {e}")
+        logger.error(f"Ошибка в process_assignee_selection: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 async def process_priority_selection(message: Message, state: FSMContext):
     """Обработчик выбора приоритета"""
     try:
-        print("=== Вызван process_priority_selection ===")
+        logger.debug("=== Вызван process_priority_selection ===")
         
         if message.text == "🔥 Срочная":
             # Сохраняем срочную задачу
@@ -427,13 +431,13 @@ async def process_priority_selection(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        print(f"Ошибка в process_priority_selection: {e}")
+        logger.error(f"Ошибка в process_priority_selection: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
-async def process_deadline_selection(message: Message, state: FSMContext):
+async def process_deadline_selection(message: Message, state: FSMContext, user=None):
     """Обработчик выбора дедлайна"""
     try:
-        print("=== Вызван process_deadline_selection ===")
+        logger.debug("=== Вызван process_deadline_selection ===")
         
         # Определяем дедлайн
         now = datetime.now()
@@ -461,30 +465,136 @@ async def process_deadline_selection(message: Message, state: FSMContext):
             return
         
         # Создаем задачу в БД
-        await create_final_task(message, state, deadline)
+        await create_final_task(message, state, deadline, user)
         
     except Exception as e:
-        print(f"Ошибка в process_deadline_selection: {e}")
+        logger.error(f"Ошибка в process_deadline_selection: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
-async def create_final_task(message: Message, state: FSMContext, deadline):
+# Типы документов по расширению файла
+CONTENT_TYPE_MAP = {
+    'pdf': 'application/pdf',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xls': 'application/vnd.ms-excel',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'txt': 'text/plain',
+    'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif'
+}
+
+# Сколько вложений одной задачи передается в S3 одновременно
+UPLOAD_CONCURRENCY = 3
+
+async def upload_task_file(task_id, file_info, timings):
+    """
+    Передача файла из Telegram в S3.
+    Длительности этапов добавляются в timings.
+    Возвращает результат загрузки или None
+    """
+    from main import bot
+    
+    try:
+        if file_info['type'] == 'photo':
+            file_name = f"photo_{file_info['file_id']}.jpg"
+            content_type = "image/jpeg"
+        else:
+            file_name = file_info['file_name']
+            # Определяем content_type по расширению
+            extension = file_name.split('.')[-1].lower() if '.' in file_name else ''
+            content_type = CONTENT_TYPE_MAP.get(extension, 'application/octet-stream')
+        
+        file_storage = get_file_storage()
+        
+        # Проверяем размер файла до скачивания
+        started = time.perf_counter()
+        file_obj = await bot.get_file(file_info['file_id'])
+        timings['get_file_ms'] += (time.perf_counter() - started) * 1000
+        
+        if file_obj.file_size and not file_storage.validate_file_size(file_obj.file_size):
+            logger.warning(f"Файл {file_name} слишком большой")
+            return None
+        
+        # Скачивание из Telegram частями сразу в S3, без копии файла в памяти
+        started = time.perf_counter()
+        file_url = bot.session.api.file_url(bot.token, file_obj.file_path)
+        upload_result = await file_storage.upload_stream(
+            bot.session.stream_content(file_url),
+            file_name=file_name,
+            content_type=content_type,
+            task_id=task_id
+        )
+        
+        if not upload_result:
+            logger.error(f"Ошибка загрузки файла {file_name} в S3")
+            return None
+        
+        timings['transfer_ms'] += (time.perf_counter() - started) * 1000
+        
+        logger.info(f"Файл {file_name} загружен в S3")
+        return upload_result
+        
+    except Exception as e:
+        logger.error(f"Ошибка обработки файла: {e}")
+        return None
+
+async def upload_task_files(task_id, task_files, user_id):
+    """
+    Загрузка вложений задачи: до UPLOAD_CONCURRENCY файлов одновременно
+    передаются из Telegram в S3, затем все записываются в БД одной транзакцией.
+    Возвращает имена загруженных файлов
+    """
+    if not task_files:
+        return []
+    
+    started = time.perf_counter()
+    timings = {'get_file_ms': 0.0, 'transfer_ms': 0.0, 'db_ms': 0.0}
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    
+    async def transfer(file_info):
+        async with semaphore:
+            return await upload_task_file(task_id, file_info, timings)
+    
+    results = await asyncio.gather(*(transfer(file_info) for file_info in task_files))
+    uploaded = [upload_result for upload_result in results if upload_result]
+    
+    db_started = time.perf_counter()
+    saved = await FileManager.save_files_info(task_id, user_id, uploaded)
+    timings['db_ms'] = (time.perf_counter() - db_started) * 1000
+    
+    # Этапы суммируются по файлам и при параллельной загрузке превышают total
+    timings = {stage: round(value, 1) for stage, value in timings.items()}
+    timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(
+        f"Вложения задачи {task_id}: {len(uploaded)} из {len(task_files)} за {timings['total_ms']} мс",
+        extra={'upload_timings': timings}
+    )
+    
+    if not saved:
+        logger.error(f"Ошибка сохранения файлов задачи {task_id} в БД")
+        return []
+    
+    return [upload_result['original_name'] for upload_result in uploaded]
+
+async def create_final_task(message: Message, state: FSMContext, deadline, user=None):
     """Финальное создание задачи в БД"""
     try:
-        print("=== Создание задачи в БД ===")
+        logger.debug("=== Создание задачи в БД ===")
         
-        # Получаем роль пользователя для клавиатуры СРАЗУ
+        # Роль пользователя для клавиатуры
         telegram_id = message.from_user.id
-        user = UserManager.get_user_by_telegram_id(telegram_id)
         role = user['role'] if user else 'admin'
         
         # Получаем все данные из состояния
         data = await state.get_data()
         
         # Создаем задачу
-        task_id = TaskManager.create_task(
+        task_id = await TaskManager.create_task(
             title=data['task_title'],
             description=data['task_description'],
             company_id=data['company_id'],
+            company_name=data['company_name'],
             initiator_name=data['initiator_name'],
             initiator_phone=data['initiator_phone'],
             assignee_id=data['assignee_id'],
@@ -498,74 +608,8 @@ async def create_final_task(message: Message, state: FSMContext, deadline):
         
         if task_id:
             # Загружаем файлы в S3 и сохраняем в БД
-            uploaded_files = []
-            task_files = data.get('task_files', [])
+            uploaded_files = await upload_task_files(task_id, data.get('task_files', []), data['created_by'])
             
-            if task_files:
-                from main import bot
-                for file_info in task_files:
-                    try:
-                        # Скачиваем файл из Telegram
-                        if file_info['type'] == 'photo':
-                            file_obj = await bot.get_file(file_info['file_id'])
-                            file_stream = await bot.download_file(file_obj.file_path)
-                            file_data = file_stream.read()  # Читаем данные из BytesIO
-                            file_name = f"photo_{file_info['file_id']}.jpg"
-                            content_type = "image/jpeg"
-                        elif file_info['type'] == 'document':
-                            file_obj = await bot.get_file(file_info['file_id'])
-                            file_stream = await bot.download_file(file_obj.file_path)
-                            file_data = file_stream.read()  # Читаем данные из BytesIO
-                            file_name = file_info['file_name']
-                            # Определяем content_type по расширению
-                            extension = file_name.split('.')[-1].lower() if '.' in file_name else ''
-                            content_type_map = {
-                                'pdf': 'application/pdf',
-                                'doc': 'application/msword',
-                                'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                                'xls': 'application/vnd.ms-excel',
-                                'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                                'txt': 'text/plain',
-                                'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
-                                'png': 'image/png',
-                                'gif': 'image/gif'
-                            }
-                            content_type = content_type_map.get(extension, 'application/octet-stream')
-                        
-                        # Проверяем размер файла
-                        if not file_storage.validate_file_size(len(file_data)):
-                            print(f"Файл {file_name} слишком большой")
-                            continue
-                        
-                        # Загружаем в S3
-                        upload_result = file_storage.upload_file(
-                            file_data=file_data,
-                            file_name=file_name,
-                            content_type=content_type,
-                            task_id=task_id
-                        )
-                        
-                        if upload_result:
-                            # Сохраняем информацию о файле в БД
-                            if FileManager.save_file_info(
-                                task_id=task_id,
-                                user_id=data['created_by'],
-                                file_id=upload_result['file_id'],
-                                file_name=upload_result['original_name'],
-                                file_path=upload_result['s3_key'],
-                                file_size=upload_result['size'],
-                                content_type=upload_result['content_type'],
-                                thumbnail_path=upload_result['thumbnail_key']
-                            ):
-                                uploaded_files.append(upload_result['original_name'])
-                                print(f"Файл {file_name} успешно загружен")
-                            else:
-                                print(f"Ошибка сохранения файла {file_name} в БД")
-                        else:
-                            print(f"Ошибка загрузки файла {file_name} в S3")
-                            
-                    except Exception as e:
-                        print(f"Ошибка обработки файла: {e}")
             # Формируем сообщение об успехе
             success_text = "✅ Задача успешно создана!\n\n"
             success_text += f"📋 Название: {data['task_title']}\n"
@@ -588,7 +632,7 @@ async def create_final_task(message: Message, state: FSMContext, deadline):
             # Уведомляем исполнителя о новой задаче
             try:
                 assignee_telegram_id = None
-                assignees = UserManager.get_assignees()
+                assignees = await UserManager.get_assignees()
                 for assignee in assignees:
                     if assignee['user_id'] == data['assignee_id']:
                         assignee_telegram_id = assignee['telegram_id']
@@ -604,7 +648,7 @@ async def create_final_task(message: Message, state: FSMContext, deadline):
                     
                     await bot.send_message(assignee_telegram_id, notification_text)
             except Exception as e:
-                print(f"Ошибка отправки уведомления: {e}")
+                logger.error(f"Ошибка отправки уведомления: {e}")
             
         else:
             await message.answer(
@@ -613,13 +657,13 @@ async def create_final_task(message: Message, state: FSMContext, deadline):
             )
         
     except Exception as e:
-        print(f"Ошибка в create_final_task: {e}")
+        logger.error(f"Ошибка в create_final_task: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
-async def process_custom_date(message: Message, state: FSMContext):
+async def process_custom_date(message: Message, state: FSMContext, user=None):
     """Обработчик ввода пользовательской даты"""
     try:
-        print("=== Вызван process_custom_date ===")
+        logger.debug("=== Вызван process_custom_date ===")
         
         from datetime import datetime, timedelta
         import re
@@ -669,10 +713,10 @@ async def process_custom_date(message: Message, state: FSMContext):
             return
         
         # Создаем задачу в БД
-        await create_final_task(message, state, deadline)
+        await create_final_task(message, state, deadline, user)
         
     except Exception as e:
-        print(f"Ошибка в process_custom_date: {e}")
+        logger.error(f"Ошибка в process_custom_date: {e}")
         await message.answer("Произошла ошибка. Попробуйте позже.")
 
 def create_company_keyboard(companies):
@@ -772,7 +816,7 @@ def create_calendar_keyboard(year, month):
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-async def process_calendar_callback(callback: CallbackQuery, state: FSMContext):
+async def process_calendar_callback(callback: CallbackQuery, state: FSMContext, user=None):
     """Обработчик нажатий на календарь"""
     try:
         data = callback.data
@@ -799,7 +843,7 @@ async def process_calendar_callback(callback: CallbackQuery, state: FSMContext):
             await callback.message.edit_text(
                 f"✅ Выбрана дата: {deadline.strftime('%d.%m.%Y')}"
             )
-            await create_final_task_from_callback(callback, state, deadline)
+            await create_final_task_from_callback(callback, state, deadline, user)
             return
         
         elif data.startswith("cal_nav_"):
@@ -823,33 +867,33 @@ async def process_calendar_callback(callback: CallbackQuery, state: FSMContext):
             await callback.message.edit_text(
                 f"✅ Выбрана дата: {deadline.strftime('%d.%m.%Y')}"
             )
-            await create_final_task_from_callback(callback, state, deadline)
+            await create_final_task_from_callback(callback, state, deadline, user)
             return
         
         await callback.answer()
         
     except Exception as e:
-        print(f"Ошибка в process_calendar_callback: {e}")
+        logger.error(f"Ошибка в process_calendar_callback: {e}")
         await callback.answer("Произошла ошибка")
 
-async def create_final_task_from_callback(callback: CallbackQuery, state: FSMContext, deadline):
+async def create_final_task_from_callback(callback: CallbackQuery, state: FSMContext, deadline, user=None):
     """Создание задачи из callback календаря"""
     try:
-        print("=== Создание задачи из календаря ===")
+        logger.debug("=== Создание задачи из календаря ===")
         
-        # Получаем роль пользователя для клавиатуры
+        # Роль пользователя для клавиатуры
         telegram_id = callback.from_user.id
-        user = UserManager.get_user_by_telegram_id(telegram_id)
         role = user['role'] if user else 'admin'
         
         # Получаем все данные из состояния
         data = await state.get_data()
         
         # Создаем задачу
-        task_id = TaskManager.create_task(
+        task_id = await TaskManager.create_task(
             title=data['task_title'],
             description=data['task_description'],
             company_id=data['company_id'],
+            company_name=data['company_name'],
             initiator_name=data['initiator_name'],
             initiator_phone=data['initiator_phone'],
             assignee_id=data['assignee_id'],
@@ -863,73 +907,8 @@ async def create_final_task_from_callback(callback: CallbackQuery, state: FSMCon
         
         if task_id:
             # Загружаем файлы в S3 и сохраняем в БД
-            uploaded_files = []
-            task_files = data.get('task_files', [])
+            uploaded_files = await upload_task_files(task_id, data.get('task_files', []), data['created_by'])
             
-            if task_files:
-                from main import bot
-                for file_info in task_files:
-                    try:
-                        # Скачиваем файл из Telegram
-                        if file_info['type'] == 'photo':
-                            file_obj = await bot.get_file(file_info['file_id'])
-                            file_data = await bot.download_file(file_obj.file_path)
-                            file_name = f"photo_{file_info['file_id']}.jpg"
-                            content_type = "image/jpeg"
-                        elif file_info['type'] == 'document':
-                            file_obj = await bot.get_file(file_info['file_id'])
-                            file_data = await bot.download_file(file_obj.file_path)
-                            file_name = file_info['file_name']
-                            # Определяем content_type по расширению
-                            extension = file_name.split('.')[-1].lower() if '.' in file_name else ''
-                            content_type_map = {
-                                'pdf': 'application/pdf',
-                                'doc': 'application/msword',
-                                'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                                'xls': 'application/vnd.ms-excel',
-                                'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                                'txt': 'text/plain',
-                                'jpg': 'image/jpeg', 'jpeg': 'image/jpeg',
-                                'png': 'image/png',
-                                'gif': 'image/gif'
-                            }
-                            content_type = content_type_map.get(extension, 'application/octet-stream')
-                        
-                        # Проверяем размер файла
-                        if not file_storage.validate_file_size(len(file_data)):
-                            print(f"Файл {file_name} слишком большой")
-                            continue
-                        
-                        # Загружаем в S3
-                        upload_result = file_storage.upload_file(
-                            file_data=file_data,
-                            file_name=file_name,
-                            content_type=content_type,
-                            task_id=task_id
-                        )
-                        
-                        if upload_result:
-                            # Сохраняем информацию о файле в БД
-                            if FileManager.save_file_info(
-                                task_id=task_id,
-                                user_id=data['created_by'],
-                                file_id=upload_result['file_id'],
-                                file_name=upload_result['original_name'],
-                                file_path=upload_result['s3_key'],
-                                file_size=upload_result['size'],
-                                content_type=upload_result['content_type'],
-                                thumbnail_path=upload_result['thumbnail_key']
-                            ):
-                                uploaded_files.append(upload_result['original_name'])
-                                print(f"Файл {file_name} успешно загружен")
-                            else:
-                                print(f"Ошибка сохранения файла {file_name} в БД")
-                        else:
-                            print(f"Ошибка загрузки файла {file_name} в S3")
-                            
-                    except Exception as e:
-                        print(f"Ошибка обработки файла: {e}")
-                        
             is_urgent = data.get('is_urgent', False)
             priority_text = "🔥 Срочная" if is_urgent else ""
 
@@ -954,7 +933,7 @@ async def create_final_task_from_callback(callback: CallbackQuery, state: FSMCon
             # Уведомляем исполнителя о новой задаче
             try:
                 assignee_telegram_id = None
-                assignees = UserManager.get_assignees()
+                assignees = await UserManager.get_assignees()
                 for assignee in assignees:
                     if assignee['user_id'] == data['assignee_id']:
                         assignee_telegram_id = assignee['telegram_id']
@@ -971,7 +950,7 @@ async def create_final_task_from_callback(callback: CallbackQuery, state: FSMCon
                     
                     await bot.send_message(assignee_telegram_id, notification_text)
             except Exception as e:
-                print(f"Ошибка отправки уведомления: {e}")
+                logger.error(f"Ошибка отправки уведомления: {e}")
             
         else:
             await callback.message.answer(
@@ -980,5 +959,5 @@ async def create_final_task_from_callback(callback: CallbackQuery, state: FSMCon
             )
         
     except Exception as e:
-        print(f"Ошибка в create_final_task_from_callback: {e}")
+        logger.error(f"Ошибка в create_final_task_from_callback: {e}")
         await callback.answer("Произошла ошибка")
\ No newline at end of file
@@ -1,14 +1,26 @@
+import time
+
+# Начало импорта модуля - для отчета о холодном старте
+_import_started = time.perf_counter()
+
 import os
 import json
+import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.types import Update
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
 from database.connection import db_connection
-from database.models import DatabaseManager
-from handlers.start import register_start_handlers
-from handlers.companies import register_company_handlers
-from handlers.tasks import register_task_handlers
-from handlers.my_tasks import register_my_tasks_handlers
+from database.fsm_storage import YDBStorage
+from database.models import DatabaseManager, TaskManager, UpdateManager
+from utils.middlewares import UserMiddleware, LatencyMiddleware, TelegramSpanMiddleware
+from utils.logger import get_logger, bind_update, flush_logs
+from utils.metrics import start_update_spans, finish_update_spans, record_inline_reply
+
+# Длительность импорта зависимостей, мс (обработчики загружаются
+# в register_handlers; разбивка по модулям - tests/test_import_time.py)
+IMPORT_MS = round((time.perf_counter() - _import_started) * 1000, 1)
+
+logger = get_logger(__name__)
 
 # Получение токена бота
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -16,69 +28,420 @@ if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN environment variable is required")
 
 # Создание экземпляров бота и диспетчера с хранилищем состояний
-storage = MemoryStorage()
+# (в YDB: следующее обновление может попасть на другой экземпляр функции)
+storage = YDBStorage()
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(storage=storage)
 
-def init_database():
+# Состояние экземпляра функции: переживает тёплые вызовы
+_initialized = False
+_init_lock = None
+
+# Сводка экземпляра (самые нагружающие запросы) пишется в лог
+# не чаще раза в STATS_INTERVAL_S секунд
+STATS_INTERVAL_S = float(os.getenv('STATS_INTERVAL_S', '300'))
+QUERY_STATS_TOP = 5
+_stats_logged_at = time.monotonic()
+
+async def init_database():
     """Инициализация базы данных"""
     try:
         # Подключение к базе
-        if not db_connection.connect():
+        if not await db_connection.connect():
             raise Exception("Не удалось подключиться к базе данных")
         
-        # DatabaseManager.create_tables() - закомментировано, таблицы созданы вручную
-        print("База данных инициализирована успешно")
+        # Схема создаётся и обновляется отдельно - входной точкой migrate_handler
+        logger.info("База данных инициализирована успешно")
         
     except Exception as e:
-        print(f"Ошибка инициализации базы данных: {e}")
+        logger.error(f"Ошибка инициализации базы данных: {e}")
         raise e
 
 def register_handlers():
-    """Регистрация всех обработчиков"""
+    """
+    Регистрация всех обработчиков.
+    Модули обработчиков импортируются здесь, а не при импорте main:
+    их загрузка входит в handlers_ms холодного старта
+    """
+    from handlers.start import register_start_handlers
+    from handlers.companies import register_company_handlers
+    from handlers.tasks import register_task_handlers
+    from handlers.my_tasks import register_my_tasks_handlers
+    
+    # Пользователь загружается один раз на обновление
+    dp.update.outer_middleware(UserMiddleware())
+    
+    # Замеры задержек: имя обработчика и время вызовов Bot API
+    dp.message.middleware(LatencyMiddleware())
+    dp.callback_query.middleware(LatencyMiddleware())
+    bot.session.middleware(TelegramSpanMiddleware())
+    
     register_start_handlers(dp)
     register_company_handlers(dp)
     register_task_handlers(dp)
     register_my_tasks_handlers(dp)
 
-async def process_update(event, context):
-    """Основная функция для обработки обновлений от Telegram"""
-    try:
-        print("=== Начало обработки обновления ===")
+async def ensure_initialized():
+    """
+    Однократная инициализация экземпляра функции.
+    Драйвер YDB, пул сессий и обработчики создаются при холодном старте
+    и переиспользуются тёплыми вызовами (клиент S3 - при первой загрузке файла).
+    Возвращает (is_cold, timings), timings - длительности этапов в мс
+    """
+    global _initialized, _init_lock
+    
+    if _initialized:
+        return False, {}
+    
+    if _init_lock is None:
+        _init_lock = asyncio.Lock()
+    
+    async with _init_lock:
+        # Другой вызов мог завершить инициализацию, пока мы ждали блокировку
+        if _initialized:
+            return False, {}
+        
+        timings = {'import_ms': IMPORT_MS}
         
-        # Инициализация базы данных при первом запуске
-        init_database()
+        started = time.perf_counter()
+        await init_database()
+        timings['database_ms'] = round((time.perf_counter() - started) * 1000, 1)
         
-        # Регистрация обработчиков
+        started = time.perf_counter()
         register_handlers()
-        print("Обработчики зарегистрированы")
+        timings['handlers_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        
+        _initialized = True
+        return True, timings
+
+async def feed_update_data(update_data):
+    """Разбор и обработка одного обновления через aiogram"""
+    update = Update.model_validate(update_data, context={'bot': bot})
+    logger.debug(f"Update создан, есть message: {update.message is not None}")
+    
+    # Асинхронная обработка обновления через aiogram
+    return await dp.feed_update(bot, update)
+
+async def handle_update_data(update_data, flush_state=True):
+    """
+    Обработка обновления с защитой от повторной доставки вебхука.
+    Сохранение состояния FSM входит в обработку: при ошибке обработчика
+    или записи состояния отметка снимается, и повтор будет обработан.
+    flush_state=False - состояние сохраняет вызывающий (пачка обновлений)
+    Возвращает (is_duplicate, результат обработчика)
+    """
+    update_id = update_data.get('update_id')
+    
+    # Записи логов обработки помечаются update_id
+    bind_update(update_id)
+    spans = start_update_spans()
+    
+    try:
+        # Проверка до разбора Update: повтор отбрасывается сразу
+        if update_id is not None and not await UpdateManager.claim_update(update_id):
+            logger.info(f"Обновление {update_id} уже обработано, пропускаем")
+            return True, None
+        
+        try:
+            try:
+                result = await feed_update_data(update_data)
+            finally:
+                # Изменения состояния записываются одним запросом на обновление
+                if flush_state:
+                    await storage.flush()
+            return False, result
+        except Exception:
+            if update_id is not None:
+                await UpdateManager.release_update(update_id)
+            raise
+    finally:
+        # Сводка по обновлению: БД, S3, Telegram и остальное время
+        summary = finish_update_spans(spans)
+        logger.info(
+            f"Обработчик {summary['handler']}: {summary['total_ms']} мс "
+            f"(db {summary['db_ms']}, s3 {summary['s3_ms']}, "
+            f"telegram {summary['telegram_ms']}, python {summary['python_ms']})",
+            extra={'spans': summary}
+        )
+
+def build_webhook_response(method):
+    """
+    Тело ответа вебхука с вызовом метода Bot API - Telegram выполнит его сам,
+    без отдельного HTTPS-запроса из функции.
+    None, если метод нельзя передать в ответе (загрузка файлов)
+    """
+    files = {}
+    params = bot.session.prepare_value(method.model_dump(warnings=False), bot=bot, files=files)
+    if files:
+        return None
+    
+    response = json.loads(params)
+    response['method'] = method.__api_method__
+    return response
+
+def extract_updates(event):
+    """
+    Список обновлений из события: сообщения триггера очереди
+    (event['messages']) или тело запроса с JSON-массивом/объектом
+    """
+    if 'messages' in event:
+        updates = [
+            json.loads(queue_message['details']['message']['body'])
+            for queue_message in event['messages']
+        ]
+    else:
+        body = json.loads(event['body'])
+        updates = body if isinstance(body, list) else [body]
+    
+    for update_data in updates:
+        if not isinstance(update_data, dict):
+            raise ValueError(f"Обновление должно быть JSON-объектом, получено: {update_data!r}")
+    
+    return updates
+
+def get_update_chat_id(update_data):
+    """Чат обновления - обновления одного чата обрабатываются по порядку"""
+    for key in ('message', 'edited_message', 'channel_post', 'callback_query', 'my_chat_member'):
+        payload = update_data.get(key)
+        if not payload:
+            continue
+        
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        if payload.get('from'):
+            return payload['from']['id']
+    
+    # Без чата обновление обрабатывается независимо от остальных
+    return f"update_{update_data.get('update_id')}"
+
+async def process_batch(event, context):
+    """
+    Обработка пачки обновлений за один вызов.
+    Разные чаты обрабатываются параллельно, обновления одного чата - по порядку
+    """
+    started = time.perf_counter()
+    
+    try:
+        is_cold, init_timings = await ensure_initialized()
+        update_list = extract_updates(event)
+        
+        # Группировка по чатам с сохранением порядка внутри чата
+        chats = {}
+        for index, update_data in enumerate(update_list):
+            chats.setdefault(get_update_chat_id(update_data), []).append((index, update_data))
+    except Exception as e:
+        logger.error(f"Ошибка разбора пачки обновлений: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    logger.info(
+        f"Пачка из {len(update_list)} обновлений",
+        extra={'cold_start': is_cold, 'init_timings': init_timings, 'batch_size': len(update_list)}
+    )
+    
+    results = [None] * len(update_list)
+    
+    async def process_chat(chat_updates):
+        for index, update_data in chat_updates:
+            update_started = time.perf_counter()
+            try:
+                is_duplicate, result = await handle_update_data(update_data, flush_state=False)
+                
+                # В пачке ответить в теле вебхука нельзя - вызываем метод сами
+                if isinstance(result, TelegramMethod):
+                    await bot(result)
+                
+                status = {'status': 'duplicate' if is_duplicate else 'ok'}
+            except Exception as e:
+                logger.exception(f"Ошибка обработки обновления {update_data.get('update_id')}: {e}")
+                status = {'status': 'error', 'error': str(e)}
+            
+            status['update_id'] = update_data.get('update_id')
+            status['duration_ms'] = round((time.perf_counter() - update_started) * 1000, 1)
+            results[index] = status
+    
+    await asyncio.gather(*(process_chat(chat_updates) for chat_updates in chats.values()))
+    
+    # Изменения состояний всей пачки записываются одним запросом
+    try:
+        await storage.flush()
+    except Exception as e:
+        logger.error(f"Ошибка сохранения состояний пачки: {e}")
+        
+        # Состояния не сохранены - повторная доставка пачки должна
+        # обработать обновления заново, а не отбросить как дубликаты
+        for status in results:
+            if status['status'] == 'ok' and status['update_id'] is not None:
+                await UpdateManager.release_update(status['update_id'])
         
-        # Парсинг входящего обновления
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e), 'results': results})
+        }
+    
+    total_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"Пачка обработана за {total_ms} мс", extra={'duration_ms': total_ms})
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'status': 'ok',
+            'cold_start': is_cold,
+            'init_timings': init_timings,
+            'total_ms': total_ms,
+            'per_update_ms': round(total_ms / len(update_list), 1) if update_list else 0,
+            'results': results
+        })
+    }
+
+async def process_update(event, context):
+    """Основная функция для обработки обновлений от Telegram"""
+    try:
+        # Инициализация только при холодном старте
+        is_cold, init_timings = await ensure_initialized()
+        if is_cold:
+            logger.info("Холодный старт", extra={'init_timings': init_timings})
+        
+        # Парсинг входящего обновления (полный дамп - только на уровне debug)
         update_data = json.loads(event['body'])
-        print(f"Получены данные обновления: {update_data}")
+        bind_update(update_data.get('update_id'))
+        logger.debug("Получены данные обновления: %s", update_data)
         
-        update = Update.model_validate(update_data, context={'bot': bot})
-        print(f"Update создан, есть message: {update.message is not None}")
+        started = time.perf_counter()
+        is_duplicate, result = await handle_update_data(update_data)
         
-        # Асинхронная обработка обновления через aiogram
-        await dp.feed_update(bot, update)
+        # Обработчик вернул метод Bot API - отвечаем им в теле вебхука
+        if isinstance(result, TelegramMethod):
+            webhook_response = build_webhook_response(result)
+            if webhook_response:
+                handler_ms = round((time.perf_counter() - started) * 1000, 1)
+                
+                # Экономия - среднее время того же метода при отдельном вызове
+                saved_ms = record_inline_reply(webhook_response['method'])
+                logger.info(
+                    f"Ответ {webhook_response['method']} в теле вебхука, обработка {handler_ms} мс, "
+                    f"сэкономлено ~{saved_ms if saved_ms is not None else '?'} мс",
+                    extra={'duration_ms': handler_ms, 'inline_saved_ms': saved_ms, 'cold_start': is_cold}
+                )
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps(webhook_response, ensure_ascii=False)
+                }
+            await bot(result)
         
-        print("=== Обработка завершена успешно ===")
+        handler_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(
+            f"Обработка завершена за {handler_ms} мс",
+            extra={'duration_ms': handler_ms, 'cold_start': is_cold, 'duplicate': is_duplicate}
+        )
         return {
             'statusCode': 200,
-            'body': json.dumps({'status': 'ok'})
+            'body': json.dumps({
+                'status': 'duplicate' if is_duplicate else 'ok',
+                'cold_start': is_cold,
+                'init_timings': init_timings
+            })
         }
         
     except Exception as e:
-        print(f"Ошибка обработки обновления: {e}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        logger.exception(f"Ошибка обработки обновления: {e}")
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
 
+def log_instance_stats(force=False):
+    """
+    Запись сводки экземпляра в лог, если с прошлой прошло STATS_INTERVAL_S.
+    Агрегаты запросов и счётчики кэша после записи сбрасываются: каждая
+    строка - отдельное окно, и суммы по всем экземплярам показывают,
+    какой запрос нагружает базу и как часто карточки задач берутся из кэша
+    """
+    global _stats_logged_at
+    
+    now = time.monotonic()
+    if not force and now - _stats_logged_at < STATS_INTERVAL_S:
+        return
+    
+    window_s = round(now - _stats_logged_at, 1)
+    _stats_logged_at = now
+    
+    query_stats = db_connection.get_query_stats(top=QUERY_STATS_TOP)
+    db_connection.reset_query_stats()
+    task_details_cache = TaskManager.get_task_details_cache_stats(reset=True)
+    
+    logger.info(
+        f"Статистика экземпляра за {window_s} с, "
+        f"кэш карточек задач: hit_rate {task_details_cache['hit_rate']}",
+        extra={
+            'window_s': window_s,
+            'query_stats': query_stats,
+            'task_details_cache': task_details_cache
+        }
+    )
+
 # Асинхронная точка входа для Yandex Functions
 async def handler(event, context):
     """Входная точка для Yandex Cloud Functions"""
-    return await process_update(event, context)
\ No newline at end of file
+    try:
+        return await process_update(event, context)
+    finally:
+        log_instance_stats()
+        flush_logs()
+
+async def batch_handler(event, context):
+    """Входная точка для пачки обновлений (триггер очереди или JSON-массив)"""
+    try:
+        return await process_batch(event, context)
+    finally:
+        log_instance_stats()
+        flush_logs()
+
+async def migrate_handler(event, context):
+    """
+    Входная точка миграции схемы: запускается вручную (или тестовым вызовом
+    функции) после развёртывания версии с новыми таблицами, колонками или индексами.
+    Создаёт недостающие task_counters, fsm_states, processed_updates,
+    колонку tasks.company_name и индексы idx_*, затем заполняет счётчики
+    и названия компаний по существующим задачам (DatabaseManager.migrate)
+    """
+    try:
+        await ensure_initialized()
+        result = await DatabaseManager.migrate()
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'status': 'ok', **result})
+        }
+    except Exception as e:
+        logger.error(f"Ошибка миграции базы данных: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+    finally:
+        flush_logs()
+
+async def sync_company_names_handler(event, context):
+    """
+    Входная точка для триггера-таймера: синхронизация названий компаний в задачах.
+    Переименования в таблице companies попадают в задачи только через неё
+    """
+    try:
+        await ensure_initialized()
+        fixed = await TaskManager.sync_company_names()
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'status': 'ok', 'fixed': fixed})
+        }
+    except Exception as e:
+        logger.error(f"Ошибка синхронизации названий компаний: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+    finally:
+        flush_logs()
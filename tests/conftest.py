@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Модули бота импортируются из корня репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Переменные окружения, обязательные при импорте модулей
+os.environ.setdefault('YDB_DATABASE', '/test/database')
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ.setdefault('S3_BUCKET_NAME', 'test-bucket')
+os.environ.setdefault('S3_ACCESS_KEY', 'test-key')
+os.environ.setdefault('S3_SECRET_KEY', 'test-secret')
@@ -0,0 +1,33 @@
+import json
+import asyncio
+
+import main
+
+
+def run_batch(monkeypatch, body):
+    async def ensure_initialized():
+        return False, {}
+
+    monkeypatch.setattr(main, 'ensure_initialized', ensure_initialized)
+    return asyncio.run(main.process_batch({'body': json.dumps(body)}, None))
+
+
+def test_batch_with_non_object_update_returns_error(monkeypatch):
+    response = run_batch(monkeypatch, [1])
+
+    assert response['statusCode'] == 500
+    assert 'error' in json.loads(response['body'])
+
+
+def test_batch_with_malformed_update_returns_error(monkeypatch):
+    response = run_batch(monkeypatch, [{'update_id': 1, 'message': 'text'}])
+
+    assert response['statusCode'] == 500
+
+
+def test_updates_of_one_chat_share_a_group():
+    message = {'update_id': 1, 'message': {'chat': {'id': 42}}}
+    callback = {'update_id': 2, 'callback_query': {'from': {'id': 7}, 'message': {'chat': {'id': 42}}}}
+
+    assert main.get_update_chat_id(message) == main.get_update_chat_id(callback) == 42
+    assert main.get_update_chat_id({'update_id': 3}) == 'update_3'
@@ -0,0 +1,88 @@
+import asyncio
+
+import ydb
+from ydb import _apis
+from ydb.aio.table import Session
+
+from database.connection import YDBConnection
+
+
+def make_prepare_response():
+    """Успешный ответ PrepareDataQuery"""
+    response = _apis.ydb_table.PrepareDataQueryResponse()
+    response.operation.ready = True
+    response.operation.status = _apis.StatusIds.SUCCESS
+    response.operation.result.Pack(_apis.ydb_table.PrepareQueryResult(query_id='query-1'))
+    return response
+
+
+class RpcState:
+    """Состояние вызова gRPC без подсказок сервера"""
+
+    def trailing_metadata(self):
+        return {}
+
+
+def make_session(session_id='session-1'):
+    """
+    Настоящая сессия SDK: Session.prepare и кэш состояния сессии работают
+    как есть, подменён только драйвер - он считает запросы PrepareDataQuery
+    """
+    session = Session(None, ydb.TableClientSettings())
+    session._state.set_id(session_id)
+    session.prepare_calls = []
+
+    async def driver(request, stub, method, wrap, settings, wrap_args, endpoint):
+        session.prepare_calls.append(request.yql_text)
+        return wrap(RpcState(), make_prepare_response(), *wrap_args)
+
+    session._driver = driver
+    return session
+
+
+def test_prepare_compiles_once_per_session():
+    connection = YDBConnection()
+    session = make_session()
+
+    async def run():
+        first = await connection.prepare(session, 'SELECT 1')
+        second = await connection.prepare(session, 'SELECT 1')
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert isinstance(first, ydb.DataQuery)
+    assert first is second
+    assert session.prepare_calls == ['SELECT 1']
+    assert connection.get_prepared_cache_stats() == {'hits': 1, 'misses': 1}
+
+
+def test_prepare_keeps_sessions_separate():
+    connection = YDBConnection()
+    sessions = [make_session('session-1'), make_session('session-2')]
+
+    async def run():
+        for session in sessions:
+            await connection.prepare(session, 'SELECT 1')
+
+    asyncio.run(run())
+
+    assert [session.prepare_calls for session in sessions] == [['SELECT 1'], ['SELECT 1']]
+    assert connection.get_prepared_cache_stats()['misses'] == 2
+
+
+def test_miss_after_session_reset():
+    connection = YDBConnection()
+    session = make_session()
+
+    async def run():
+        await connection.prepare(session, 'SELECT 1')
+        # Недействительная сессия сбрасывает кэш SDK - запрос компилируется заново
+        session._state.reset()
+        session._state.set_id('session-1')
+        await connection.prepare(session, 'SELECT 1')
+
+    asyncio.run(run())
+
+    assert session.prepare_calls == ['SELECT 1', 'SELECT 1']
+    assert connection.get_prepared_cache_stats() == {'hits': 0, 'misses': 2}
@@ -0,0 +1,86 @@
+import asyncio
+import tracemalloc
+
+from utils.file_storage import FileStorage, S3_PART_SIZE
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FakeS3Client:
+    """Клиент S3 без сети: запоминает только размеры частей"""
+
+    def __init__(self):
+        self.part_sizes = []
+        self.completed = False
+        self.aborted = False
+
+    def create_multipart_upload(self, **kwargs):
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Body, PartNumber, **kwargs):
+        self.part_sizes.append(len(Body))
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, **kwargs):
+        self.completed = True
+
+    def abort_multipart_upload(self, **kwargs):
+        self.aborted = True
+
+
+def make_storage():
+    storage = FileStorage()
+    storage._s3_client = FakeS3Client()
+    return storage
+
+
+async def fake_chunks(total_size, state=None):
+    """Асинхронный источник как stream_content: новые чанки, без хранения"""
+    sent = 0
+    try:
+        while sent < total_size:
+            size = min(CHUNK_SIZE, total_size - sent)
+            sent += size
+            yield bytes(size)
+    finally:
+        if state is not None:
+            state['closed'] = True
+
+
+def test_upload_stream_memory_is_bounded_by_part_size():
+    storage = make_storage()
+    total_size = 50 * 1024 * 1024
+
+    tracemalloc.start()
+    try:
+        result = asyncio.run(storage.upload_stream(fake_chunks(total_size), 'big.bin', 'application/octet-stream'))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result['size'] == total_size
+    assert storage.s3_client.completed
+    assert sum(storage.s3_client.part_sizes) == total_size
+    # Буфер части и его копия для отправки - около 2 * S3_PART_SIZE, не размер файла
+    assert peak < 2.5 * S3_PART_SIZE
+
+
+def test_upload_stream_closes_source_on_size_limit():
+    storage = make_storage()
+    storage.validate_file_size = lambda size: size <= S3_PART_SIZE + CHUNK_SIZE
+    state = {'closed': False}
+
+    async def run():
+        result = await storage.upload_stream(
+            fake_chunks(3 * S3_PART_SIZE, state), 'big.bin', 'application/octet-stream'
+        )
+        # Проверка до выхода из цикла: asyncio.run сам закрывает генераторы
+        return result, state['closed']
+
+    result, closed = asyncio.run(run())
+
+    assert result is None
+    assert storage.s3_client.aborted
+    assert not storage.s3_client.completed
+    assert closed
@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Тяжёлые зависимости, которые нужны только при работе с файлами
+DEFERRED_PREFIXES = ('boto3', 'botocore', 'PIL', 'handlers', 'utils.file_storage')
+
+
+def import_profile(module):
+    """
+    Разбивка импорта по модулям из python -X importtime:
+    {модуль: (собственное время, накопленное время)} в мкс
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT, env=os.environ.copy(), capture_output=True, text=True, check=True
+    )
+
+    profile = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def test_main_import_defers_heavy_modules(record_property):
+    profile = import_profile('main')
+
+    deferred = sorted(name for name in profile if name.startswith(DEFERRED_PREFIXES))
+    assert deferred == []
+
+    # Отчёт о холодном старте: общее время и самые дорогие пакеты верхнего уровня
+    total_ms = profile['main'][1] / 1000
+    top_level = {name: cumulative for name, (_, cumulative) in profile.items()
+                 if '.' not in name and name != 'main'}
+    breakdown = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:10]
+
+    record_property('import_main_ms', round(total_ms, 1))
+    record_property('import_breakdown_ms', {name: round(us / 1000, 1) for name, us in breakdown})
+    print(f"\nimport main: {total_ms:.1f} мс")
+    for name, cumulative in breakdown:
+        print(f"  {name:<30} {cumulative / 1000:8.1f} мс")
@@ -0,0 +1,52 @@
+import logging
+
+import main
+from database.connection import db_connection
+
+
+def stats_record(caplog):
+    records = [record for record in caplog.records if record.getMessage().startswith('Статистика экземпляра')]
+    assert len(records) == 1
+    return records[0]
+
+
+def test_instance_stats_emit_top_queries_and_reset(caplog):
+    db_connection.reset_query_stats()
+    for _ in range(3):
+        db_connection._record_query("SELECT * FROM tasks WHERE task_id = $task_id;", 12.0)
+    db_connection._record_query("SELECT 1;", 1.0)
+
+    with caplog.at_level(logging.INFO, logger='main'):
+        main.log_instance_stats(force=True)
+
+    query_stats = stats_record(caplog).query_stats
+    assert [item['calls'] for item in query_stats] == [3, 1]
+    assert query_stats[0]['total_ms'] == 36.0
+    assert db_connection.get_query_stats() == []
+
+
+def test_instance_stats_wait_for_interval(caplog, monkeypatch):
+    monkeypatch.setattr(main, 'STATS_INTERVAL_S', 3600)
+    main.log_instance_stats(force=True)
+    caplog.clear()
+
+    with caplog.at_level(logging.INFO, logger='main'):
+        main.log_instance_stats()
+
+    assert not [record for record in caplog.records if record.getMessage().startswith('Статистика экземпляра')]
+
+
+def test_instance_stats_emit_task_card_cache_hit_rate(caplog):
+    from database import models
+
+    models._task_details_cache.get_stats(reset=True)
+    models._task_details_cache.set('task-1', {'task': {}, 'files': []})
+    for task_id in ['task-1', 'task-1', 'task-1', 'task-2']:
+        models._task_details_cache.get(task_id)
+
+    with caplog.at_level(logging.INFO, logger='main'):
+        main.log_instance_stats(force=True)
+
+    cache_stats = stats_record(caplog).task_details_cache
+    assert (cache_stats['hits'], cache_stats['misses'], cache_stats['hit_rate']) == (3, 1, 0.75)
+    assert models.TaskManager.get_task_details_cache_stats()['hits'] == 0
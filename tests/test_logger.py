@@ -0,0 +1,54 @@
+import json
+import asyncio
+import logging
+import contextvars
+
+import main
+from utils import logger as logger_module
+from utils.logger import UpdateContextFilter, bind_update
+
+
+def make_record(level=logging.DEBUG):
+    return logging.LogRecord('test', level, __file__, 1, 'message', None, None)
+
+
+def test_filter_tags_records_with_bound_update():
+    def run():
+        bind_update(42)
+        record = make_record(logging.INFO)
+        assert UpdateContextFilter().filter(record)
+        return record.update_id
+
+    assert contextvars.copy_context().run(run) == 42
+
+
+def test_rebinding_same_update_keeps_debug_sample(monkeypatch):
+    draws = iter([0.0, 0.99])
+    monkeypatch.setattr(logger_module.random, 'random', lambda: next(draws))
+    monkeypatch.setattr(logger_module, 'DEBUG_SAMPLE_RATE', 0.5)
+
+    def run():
+        bind_update(7)
+        bind_update(7)
+        return UpdateContextFilter().filter(make_record())
+
+    # Первое решение (0.0 < 0.5) сохраняется, второе значение не используется
+    assert contextvars.copy_context().run(run) is True
+
+
+def test_raw_update_dump_carries_update_id(monkeypatch, caplog):
+    async def ensure_initialized():
+        return False, {}
+
+    async def handle_update_data(update_data):
+        return False, None
+
+    monkeypatch.setattr(main, 'ensure_initialized', ensure_initialized)
+    monkeypatch.setattr(main, 'handle_update_data', handle_update_data)
+    monkeypatch.setattr(logger_module, 'DEBUG_SAMPLE_RATE', 1.0)
+
+    with caplog.at_level(logging.DEBUG, logger='main'):
+        asyncio.run(main.process_update({'body': json.dumps({'update_id': 99})}, None))
+
+    dumps = [record for record in caplog.records if record.getMessage().startswith('Получены данные обновления')]
+    assert [record.update_id for record in dumps] == [99]
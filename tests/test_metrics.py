@@ -0,0 +1,98 @@
+import contextvars
+
+from utils.metrics import (
+    start_update_spans, set_span_handler, finish_update_spans, observe_telegram_call,
+    record_inline_reply, get_latency_stats, reset_latency_stats
+)
+
+
+def in_context(func):
+    """Спаны хранятся в contextvars - каждый тест в своём контексте"""
+    return contextvars.copy_context().run(func)
+
+
+def test_inline_reply_saving_is_the_average_direct_call():
+    reset_latency_stats()
+    observe_telegram_call('sendMessage', 40.0)
+    observe_telegram_call('sendMessage', 60.0)
+
+    def run():
+        spans = start_update_spans()
+        set_span_handler('start_command')
+        summary = finish_update_spans(spans)
+        return summary, record_inline_reply('sendMessage'), record_inline_reply('answerCallbackQuery')
+
+    summary, saved_ms, unknown_ms = in_context(run)
+
+    assert saved_ms == 50.0
+    assert unknown_ms is None
+
+    stats = get_latency_stats()['start_command']
+    assert stats['inline_saved']['count'] == 1
+    assert stats['inline_saved']['avg_ms'] == 50.0
+    assert stats['total_without_inline']['avg_ms'] == round(summary['total_ms'] + 50.0, 1)
+
+
+class FakeClock:
+    """perf_counter с ручным сдвигом времени"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000
+
+
+def test_spans_feed_histogram_buckets_and_percentiles(monkeypatch):
+    from utils import metrics
+
+    clock = FakeClock()
+    monkeypatch.setattr(metrics.time, 'perf_counter', clock)
+    reset_latency_stats()
+
+    # 10 обновлений: db 3 мс x8, 40 мс и 700 мс; python по 2 мс
+    db_durations = [3] * 8 + [40, 700]
+
+    def run(db_ms):
+        spans = start_update_spans()
+        set_span_handler('task_callback')
+        with metrics.span('db'):
+            clock.advance(db_ms)
+        clock.advance(2)
+        return finish_update_spans(spans)
+
+    summaries = [in_context(lambda db_ms=db_ms: run(db_ms)) for db_ms in db_durations]
+
+    assert summaries[-1] == {
+        'handler': 'task_callback', 'total_ms': 702.0,
+        'db_ms': 700.0, 's3_ms': 0.0, 'telegram_ms': 0.0, 'python_ms': 2.0
+    }
+
+    db = get_latency_stats()['task_callback']['db']
+    assert db['count'] == 10
+    assert db['buckets']['5'] == 8
+    assert db['buckets']['50'] == 1
+    assert db['buckets']['1000'] == 1
+    assert db['p50_ms'] == 5.0
+    assert db['p95_ms'] == 1000.0
+    assert db['max_ms'] == 700.0
+
+    total = get_latency_stats()['task_callback']['total']
+    assert total['p50_ms'] == 5.0
+    assert get_latency_stats()['task_callback']['s3']['buckets']['5'] == 10
+
+
+def test_percentile_above_last_bucket_is_the_maximum():
+    from utils.metrics import LatencyHistogram
+
+    histogram = LatencyHistogram()
+    for value_ms in [1, 6000, 9000]:
+        histogram.observe(value_ms)
+
+    stats = histogram.get_stats()
+    assert stats['buckets']['inf'] == 2
+    assert stats['p95_ms'] == 9000.0
+    assert histogram.percentile(0.3) == 5.0
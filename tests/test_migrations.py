@@ -0,0 +1,43 @@
+import asyncio
+
+import ydb
+
+from database import models
+from database.models import DatabaseManager, TaskManager
+
+
+def test_migrate_runs_steps_in_order(monkeypatch):
+    steps = []
+
+    def step(name, result=None):
+        async def run():
+            steps.append(name)
+            return result
+        return run
+
+    monkeypatch.setattr(DatabaseManager, 'create_tables', step('tables'))
+    monkeypatch.setattr(DatabaseManager, 'add_columns', step('columns'))
+    monkeypatch.setattr(DatabaseManager, 'create_indexes', step('indexes'))
+    monkeypatch.setattr(DatabaseManager, 'rebuild_task_counters', step('counters', True))
+    monkeypatch.setattr(TaskManager, 'sync_company_names', step('names', 3))
+
+    result = asyncio.run(DatabaseManager.migrate())
+
+    assert steps == ['tables', 'columns', 'indexes', 'counters', 'names']
+    assert result == {'company_names_fixed': 3}
+
+
+def test_existing_schema_objects_are_skipped(monkeypatch):
+    executed = []
+
+    async def execute_scheme(query):
+        executed.append(query)
+        raise ydb.issues.AlreadyExists("path exist")
+
+    monkeypatch.setattr(models.db_connection, 'execute_scheme', execute_scheme)
+
+    asyncio.run(DatabaseManager.create_tables())
+    asyncio.run(DatabaseManager.add_columns())
+    asyncio.run(DatabaseManager.create_indexes())
+
+    assert len(executed) == 8 + len(models.ADDED_COLUMNS) + len(models.SECONDARY_INDEXES)
@@ -0,0 +1,88 @@
+import os
+import json
+import asyncio
+
+from database import models
+from database.models import (
+    DatabaseManager, INDEXED_TABLES, TASKS_PAGE_SIZE, TaskManager,
+    find_full_scans, find_full_scan_reads
+)
+
+
+# Планы в формате EXPLAIN YDB; обновляются из живой базы
+# командой python -m utils.capture_query_plans
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'query_plans')
+
+
+def load_plan(name):
+    with open(os.path.join(FIXTURES_DIR, f'{name}.json')) as file:
+        return json.load(file)
+
+
+def run_check(monkeypatch, overrides=None):
+    """check_query_plans с планами из фикстур: по одной на каждый частый запрос"""
+    plans = {query: name for name, query in DatabaseManager.hot_queries()}
+    overrides = overrides or {}
+    explained = []
+
+    async def explain(query):
+        name = plans[query]
+        explained.append(name)
+        return json.dumps(load_plan(overrides.get(name, name)))
+
+    monkeypatch.setattr(models.db_connection, 'explain', explain)
+    return asyncio.run(DatabaseManager.check_query_plans()), explained
+
+
+def test_fixture_exists_for_every_hot_query():
+    for name, _ in DatabaseManager.hot_queries():
+        assert os.path.exists(os.path.join(FIXTURES_DIR, f'{name}.json')), name
+
+
+def test_hot_queries_cover_first_pages_of_both_roles():
+    queries = dict(DatabaseManager.hot_queries())
+
+    assert queries['get_user_tasks_page_first'] == TaskManager._tasks_page_query(
+        '', 'admin', None, 'next', TASKS_PAGE_SIZE
+    )[0]
+    assert queries['get_user_tasks_page_director_first'] == TaskManager._tasks_page_query(
+        '', 'director', None, 'next', TASKS_PAGE_SIZE
+    )[0]
+
+
+def test_index_reads_by_key_prefix_are_not_full_scans():
+    for name in ['get_user_by_telegram_id', 'get_user_tasks_page_first', 'get_user_tasks_page',
+                 'get_user_tasks_page_director', 'get_user_tasks_page_company_first',
+                 'count_user_tasks', 'get_task_details']:
+        assert find_full_scans(load_plan(name), INDEXED_TABLES) == [], name
+
+
+def test_director_first_page_is_a_limited_full_index_read():
+    plan = load_plan('get_user_tasks_page_director_first')
+
+    assert find_full_scans(plan, INDEXED_TABLES) == ['tasks/idx_created_at']
+    assert find_full_scan_reads(plan, INDEXED_TABLES) == [('tasks/idx_created_at', '$limit')]
+
+
+def test_check_query_plans_passes_on_current_plans(monkeypatch):
+    regressions, explained = run_check(monkeypatch)
+
+    assert regressions == {}
+    assert explained == [name for name, _ in DatabaseManager.hot_queries()]
+
+
+def test_check_query_plans_reports_unlimited_index_read(monkeypatch):
+    regressions, _ = run_check(monkeypatch, {
+        'count_user_tasks': 'regression_count_over_idx_created_at'
+    })
+
+    assert regressions == {'count_user_tasks': ['tasks/idx_created_at']}
+
+
+def test_known_full_read_without_limit_is_a_regression(monkeypatch):
+    # Первая страница директора без ReadLimit читала бы весь индекс
+    regressions, _ = run_check(monkeypatch, {
+        'get_user_tasks_page_director_first': 'regression_count_over_idx_created_at'
+    })
+
+    assert regressions == {'get_user_tasks_page_director_first': ['tasks/idx_created_at']}
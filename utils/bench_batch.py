@@ -0,0 +1,100 @@
+"""
+Замер обработки пачки обновлений против отдельных вызовов.
+
+    python -m utils.bench_batch [--count 50] [--chats 10] [--db-ms 5] [--telegram-ms 30]
+
+Сравнивает N вызовов process_update (по обновлению на вызов) с одним
+process_batch из тех же N обновлений. Бот и база заменены заглушками
+с фиксированными задержками: отметка обновления и сохранение состояний -
+db-ms, обработчик - запрос к базе и ответ через Bot API (telegram-ms).
+Разбор Update в aiogram выполняется по-настоящему. Экземпляр тёплый в обоих
+случаях: разница - в сохранении состояний и параллельной обработке чатов
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+# Переменные окружения, обязательные при импорте main (сеть не используется)
+os.environ.setdefault('BOT_TOKEN', '123456:BENCH')
+os.environ.setdefault('YDB_DATABASE', '/bench')
+
+import main
+from aiogram.types import Update
+
+def make_update(update_id, chat_id):
+    """Текстовое сообщение /start от пользователя чата chat_id"""
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': user,
+            'text': '/start'
+        }
+    }
+
+def install_stubs(db_ms, telegram_ms):
+    """Заглушки базы и бота с задержками вместо сетевых вызовов"""
+    async def db_call(*args, **kwargs):
+        await asyncio.sleep(db_ms / 1000)
+        return True
+
+    async def ensure_initialized():
+        return False, {}
+
+    async def feed_update_data(update_data):
+        Update.model_validate(update_data, context={'bot': main.bot})
+        await db_call()
+        await asyncio.sleep(telegram_ms / 1000)
+        return None
+
+    main.ensure_initialized = ensure_initialized
+    main.feed_update_data = feed_update_data
+    main.UpdateManager.claim_update = staticmethod(db_call)
+    main.UpdateManager.release_update = staticmethod(db_call)
+    main.storage.flush = db_call
+
+async def measure_single(updates):
+    """Время на обновление при отдельном вызове на каждое, мс"""
+    started = time.perf_counter()
+    for update_data in updates:
+        response = await main.process_update({'body': json.dumps(update_data)}, None)
+        assert response['statusCode'] == 200, response
+    return (time.perf_counter() - started) * 1000 / len(updates)
+
+async def measure_batch(updates):
+    """Время на обновление в одном вызове с пачкой, мс"""
+    started = time.perf_counter()
+    response = await main.process_batch({'body': json.dumps(updates)}, None)
+    assert response['statusCode'] == 200, response
+    return (time.perf_counter() - started) * 1000 / len(updates)
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--db-ms', type=float, default=5)
+    parser.add_argument('--telegram-ms', type=float, default=30)
+    args = parser.parse_args()
+
+    # Сводки по каждому обновлению в замер не выводятся
+    logging.getLogger().setLevel(logging.WARNING)
+    install_stubs(args.db_ms, args.telegram_ms)
+
+    single_updates = [make_update(index, 1000 + index % args.chats) for index in range(args.count)]
+    batch_updates = [make_update(args.count + index, 1000 + index % args.chats) for index in range(args.count)]
+
+    print(f"{args.count} обновлений из {args.chats} чатов, db {args.db_ms} мс, telegram {args.telegram_ms} мс")
+    single_ms = asyncio.run(measure_single(single_updates))
+    batch_ms = asyncio.run(measure_batch(batch_updates))
+    print(f"Отдельные вызовы: {single_ms:.1f} мс/обновление")
+    print(f"Пачка: {batch_ms:.1f} мс/обновление (x{single_ms / batch_ms:.1f})")
+    main.flush_logs()
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,80 @@
+"""
+Замер генерации превью на больших JPEG (размер фото с телефона).
+
+    python -m utils.bench_thumbnails [--count 8] [--width 4032] [--height 3024]
+
+Сравнивает исходный способ (полное декодирование и LANCZOS для каждого
+размера) с render_thumbnails (draft-декодирование, все размеры из одного
+декодирования) и показывает пропускную способность пула процессов
+"""
+import io
+import time
+import asyncio
+import argparse
+
+from PIL import Image
+
+from utils.file_storage import FileStorage, THUMBNAIL_SIZES, render_thumbnails
+
+def generate_jpeg(width, height, seed):
+    """Синтетическое фото: шум поверх градиента (плохо сжимается, как реальные снимки)"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 64 + seed)
+    image = Image.merge('RGB', (gradient, noise, gradient.rotate(180)))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=92)
+    return buffer.getvalue()
+
+def render_full_decode(file_data, sizes):
+    """Исходный способ: полное декодирование для каждого размера"""
+    thumbnails = {}
+    for suffix, size in sizes.items():
+        image = Image.open(io.BytesIO(file_data))
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=85)
+        thumbnails[suffix] = (buffer.getvalue(), 'JPEG')
+    return thumbnails
+
+def measure(func, corpus):
+    """Среднее время на изображение, мс"""
+    started = time.perf_counter()
+    for file_data in corpus:
+        func(file_data, THUMBNAIL_SIZES)
+    return (time.perf_counter() - started) * 1000 / len(corpus)
+
+async def measure_pool(storage, corpus):
+    """Время на изображение при параллельной генерации в пуле, мс"""
+    # Первый вызов запускает процессы пула - в замер не входит
+    await storage._render_thumbnails(corpus[0])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(storage._render_thumbnails(file_data) for file_data in corpus))
+    return (time.perf_counter() - started) * 1000 / len(corpus)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=8)
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    args = parser.parse_args()
+
+    corpus = [generate_jpeg(args.width, args.height, seed) for seed in range(args.count)]
+    average_kb = sum(len(file_data) for file_data in corpus) / len(corpus) / 1024
+    print(f"Корпус: {args.count} JPEG {args.width}x{args.height}, в среднем {average_kb:.0f} КБ")
+
+    full_ms = measure(render_full_decode, corpus)
+    draft_ms = measure(render_thumbnails, corpus)
+    print(f"Полное декодирование: {full_ms:.1f} мс/изобр.")
+    print(f"Draft, одно декодирование: {draft_ms:.1f} мс/изобр. (x{full_ms / draft_ms:.1f})")
+
+    # Ключи S3 для замера пула не нужны
+    storage = FileStorage.__new__(FileStorage)
+    storage._thumbnail_executor = None
+    pool_ms = asyncio.run(measure_pool(storage, corpus))
+    print(f"Пул процессов: {pool_ms:.1f} мс/изобр. ({type(storage._thumbnail_executor).__name__})")
+
+if __name__ == '__main__':
+    main()
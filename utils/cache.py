@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """LRU-кэш с ограниченным временем жизни записей"""
+    
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        """Получение значения (просроченные записи удаляются)"""
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            self.misses += 1
+            return default
+        
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key, value, ttl=None):
+        """Сохранение значения, самая старая запись вытесняется при переполнении"""
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        self._items[key] = (value, expires_at)
+        self._items.move_to_end(key)
+        
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+    
+    def pop(self, key):
+        """Удаление записи по ключу"""
+        item = self._items.pop(key, None)
+        return item[0] if item else None
+    
+    def pop_where(self, predicate):
+        """Удаление всех записей, значения которых удовлетворяют predicate"""
+        keys = [key for key, (value, _) in self._items.items() if predicate(value)]
+        for key in keys:
+            del self._items[key]
+        return len(keys)
+    
+    def clear(self):
+        """Очистка кэша"""
+        self._items.clear()
+    
+    def get_stats(self, reset=False):
+        """Статистика попаданий в кэш; reset - начать счёт заново"""
+        total = self.hits + self.misses
+        stats = {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+        
+        if reset:
+            self.hits = 0
+            self.misses = 0
+        return stats
+    
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,48 @@
+"""
+Сохранение планов частых запросов из живой базы в фикстуры тестов.
+
+    python -m utils.capture_query_plans [--out tests/fixtures/query_plans]
+
+Нужны те же переменные окружения, что и функции (YDB_ENDPOINT, YDB_DATABASE).
+Для каждого запроса из DatabaseManager.hot_queries() записывается
+<название>.json с результатом EXPLAIN; пути таблиц приводятся к /local,
+чтобы фикстуры не зависели от базы
+"""
+import os
+import json
+import asyncio
+import argparse
+
+from database.connection import db_connection
+from database.models import DatabaseManager
+
+DEFAULT_OUT = os.path.join('tests', 'fixtures', 'query_plans')
+
+async def capture(out_dir):
+    """Запись планов, возвращает число сохранённых запросов"""
+    if not await db_connection.connect():
+        raise RuntimeError("Не удалось подключиться к базе данных")
+
+    database = db_connection.database.rstrip('/')
+    try:
+        queries = DatabaseManager.hot_queries()
+        for name, query in queries:
+            plan_text = (await db_connection.explain(query)).replace(database + '/', '/local/')
+            with open(os.path.join(out_dir, f'{name}.json'), 'w') as file:
+                json.dump(json.loads(plan_text), file, ensure_ascii=False, indent=2)
+                file.write('\n')
+        return len(queries)
+    finally:
+        await db_connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', default=DEFAULT_OUT)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    count = asyncio.run(capture(args.out))
+    print(f"Сохранено планов: {count} в {args.out}")
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,76 @@
 import os
-import boto3
 import uuid
+import asyncio
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from PIL import Image
 import io
-from botocore.exceptions import ClientError
+from utils.logger import get_logger
+from utils.metrics import span
+
+logger = get_logger(__name__)
+
+# boto3 и PIL импортируются при первом обращении к хранилищу:
+# обновлениям без файлов они не нужны, а их импорт удлиняет холодный старт
+
+# Одновременные запросы к S3: размер пула потоков и пула соединений клиента
+S3_MAX_CONNECTIONS = int(os.getenv('S3_MAX_CONNECTIONS', '8'))
+
+# Размер части multipart-загрузки (минимум S3 - 5 МБ): при потоковой
+# загрузке в памяти находится не больше одной части
+S3_PART_SIZE = 8 * 1024 * 1024
+
+# Размеры превью: суффикс ключа -> максимальные ширина и высота.
+# Первое - основное (хранится в task_files.thumbnail_path)
+THUMBNAIL_SIZES = {
+    'thumb': (300, 300),
+    'thumb_small': (100, 100)
+}
+
+# Процессы для превью: декодирование изображений - чистый CPU
+THUMBNAIL_WORKERS = min(os.cpu_count() or 1, 2)
+
+# Форматы, в которых сохраняется превью (остальные - в JPEG)
+THUMBNAIL_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# Исходники больше этого размера не скачиваются для превью
+THUMBNAIL_MAX_SOURCE_SIZE = 30 * 1024 * 1024
+
+def render_thumbnails(file_data, sizes):
+    """
+    Превью всех размеров из одного декодирования изображения.
+    Выполняется в процессе пула, поэтому функция модульная.
+    Возвращает {суффикс: (данные, формат)}
+    """
+    from PIL import Image
+    
+    image = Image.open(io.BytesIO(file_data))
+    source_format = image.format
+    save_format = source_format if source_format in THUMBNAIL_FORMATS else 'JPEG'
+    
+    # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8),
+    # не меньше самого большого превью
+    largest = max(sizes.values())
+    image.draft('RGB', largest)
+    image.load()
+    
+    if save_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    
+    # Каждое следующее превью уменьшается из предыдущего
+    thumbnails = {}
+    for suffix, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        image = image.copy()
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        
+        buffer = io.BytesIO()
+        image.save(buffer, format=save_format, quality=85)
+        thumbnails[suffix] = (buffer.getvalue(), save_format)
+    
+    return thumbnails
 
 class FileStorage:
     def __init__(self):
@@ -16,23 +82,217 @@ class FileStorage:
         if not all([self.bucket_name, self.access_key, self.secret_key]):
             raise ValueError("S3 credentials not configured")
         
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.secret_key,
-            endpoint_url=self.endpoint_url
-        )
+        self._s3_client = None
+        self._client_lock = threading.Lock()
+        self._executor = None
+        self._thumbnail_executor = None
+    
+    @property
+    def s3_client(self):
+        """
+        Клиент S3, создается при первом запросе к хранилищу.
+        Соединения переиспользуются (keep-alive) потоками пула
+        """
+        if self._s3_client is None:
+            # Первые запросы могут прийти из нескольких потоков сразу
+            with self._client_lock:
+                if self._s3_client is None:
+                    import boto3
+                    from botocore.config import Config
+                    
+                    self._s3_client = boto3.client(
+                        's3',
+                        aws_access_key_id=self.access_key,
+                        aws_secret_access_key=self.secret_key,
+                        endpoint_url=self.endpoint_url,
+                        config=Config(
+                            max_pool_connections=S3_MAX_CONNECTIONS,
+                            tcp_keepalive=True,
+                            retries={'max_attempts': 3, 'mode': 'standard'}
+                        )
+                    )
+        return self._s3_client
+    
+    async def _run(self, func, *args, **kwargs):
+        """
+        Выполнение синхронного вызова boto3 в ограниченном пуле потоков,
+        чтобы запросы к S3 не останавливали цикл событий
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=S3_MAX_CONNECTIONS,
+                thread_name_prefix='s3'
+            )
+        
+        loop = asyncio.get_running_loop()
+        with span('s3'):
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+    
+    def _get_thumbnail_executor(self):
+        """
+        Пул процессов для превью. Процессы запускаются через forkserver:
+        fork процесса с потоками gRPC, aiohttp и логов может зависнуть.
+        Если процессы недоступны в окружении, используется пул потоков
+        """
+        if self._thumbnail_executor is None:
+            try:
+                self._thumbnail_executor = ProcessPoolExecutor(
+                    max_workers=THUMBNAIL_WORKERS,
+                    mp_context=multiprocessing.get_context('forkserver')
+                )
+            except (OSError, NotImplementedError, ImportError, ValueError) as e:
+                logger.warning(f"Пул процессов недоступен, превью в потоках: {e}")
+                self._thumbnail_executor = ThreadPoolExecutor(
+                    max_workers=THUMBNAIL_WORKERS,
+                    thread_name_prefix='thumbnail'
+                )
+        return self._thumbnail_executor
     
-    def upload_file(self, file_data, file_name, content_type, task_id=None):
-        """Загрузка файла в S3"""
+    async def _render_thumbnails(self, file_data):
+        """Генерация превью в пуле (при сбое процесса - повтор в потоке)"""
+        loop = asyncio.get_running_loop()
         try:
-            # Генерируем уникальное имя файла
-            file_id = str(uuid.uuid4())
-            file_extension = os.path.splitext(file_name)[1].lower()
+            return await loop.run_in_executor(
+                self._get_thumbnail_executor(), render_thumbnails, file_data, THUMBNAIL_SIZES
+            )
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning(f"Пул процессов превью недоступен, переход на потоки: {e}")
+            self._thumbnail_executor = ThreadPoolExecutor(
+                max_workers=THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnail'
+            )
+            return await loop.run_in_executor(
+                self._thumbnail_executor, render_thumbnails, file_data, THUMBNAIL_SIZES
+            )
+    
+    def thumbnail_key(self, original_key, suffix=None):
+        """Ключ превью в S3 (по умолчанию - основного размера)"""
+        base, extension = os.path.splitext(original_key)
+        return f"{base}_{suffix or next(iter(THUMBNAIL_SIZES))}{extension}"
+    
+    async def create_thumbnails(self, file_data, original_key):
+        """
+        Создание превью всех размеров для изображения и загрузка в S3.
+        Возвращает ключ основного превью или None
+        """
+        try:
+            thumbnails = await self._render_thumbnails(file_data)
             
-            # Создаем путь к файлу
-            folder = f"tasks/{task_id}" if task_id else "temp"
-            s3_key = f"{folder}/{file_id}{file_extension}"
+            for suffix, (data, save_format) in thumbnails.items():
+                await self._run(self._put_thumbnail, self.thumbnail_key(original_key, suffix), data, save_format)
+            
+            return self.thumbnail_key(original_key)
+            
+        except Exception as e:
+            logger.error(f"Ошибка создания превью: {e}")
+            return None
+    
+    async def get_or_create_thumbnail(self, original_key):
+        """
+        Превью при первом обращении: если в S3 его еще нет, исходник
+        скачивается и превью создаются. Возвращает ключ основного превью или None
+        """
+        thumbnail_key = self.thumbnail_key(original_key)
+        if await self._run(self._object_exists, thumbnail_key):
+            return thumbnail_key
+        
+        file_data = await self._run(self._get_object_data, original_key, THUMBNAIL_MAX_SOURCE_SIZE)
+        if file_data is None:
+            return None
+        
+        return await self.create_thumbnails(file_data, original_key)
+    
+    async def upload_file(self, file_data, file_name, content_type, task_id=None):
+        """Загрузка файла в S3 (превью создается при первом обращении)"""
+        return await self._run(self._upload_file, file_data, file_name, content_type, task_id)
+    
+    async def upload_stream(self, chunks, file_name, content_type, task_id=None):
+        """
+        Потоковая загрузка в S3 из асинхронного итератора чанков.
+        Данные накапливаются до S3_PART_SIZE и отправляются частями
+        multipart-загрузки, поэтому память не зависит от размера файла.
+        Файл, поместившийся в одну часть, загружается обычным PUT
+        """
+        file_id, s3_key = self._make_key(file_name, task_id)
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+        size = 0
+        
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                
+                if not self.validate_file_size(size):
+                    raise ValueError(f"Файл {file_name} превышает допустимый размер")
+                
+                if len(buffer) >= S3_PART_SIZE:
+                    if upload_id is None:
+                        upload_id = await self._run(self._create_multipart_upload, s3_key, file_name, content_type)
+                    
+                    part_data = bytes(buffer)
+                    buffer.clear()
+                    parts.append(await self._run(self._upload_part, s3_key, upload_id, len(parts) + 1, part_data))
+                    del part_data
+            
+            if upload_id is None:
+                return await self.upload_file(bytes(buffer), file_name, content_type, task_id)
+            
+            if buffer:
+                parts.append(await self._run(self._upload_part, s3_key, upload_id, len(parts) + 1, bytes(buffer)))
+                buffer.clear()
+            
+            await self._run(self._complete_multipart_upload, s3_key, upload_id, parts)
+            
+            return {
+                'file_id': file_id,
+                's3_key': s3_key,
+                'thumbnail_key': None,
+                'original_name': file_name,
+                'content_type': content_type,
+                'size': size
+            }
+            
+        except Exception as e:
+            logger.error(f"Ошибка потоковой загрузки файла: {e}")
+            if upload_id is not None:
+                await self._run(self._abort_multipart_upload, s3_key, upload_id)
+            return None
+
+        finally:
+            # При досрочном выходе закрываем источник, иначе соединение
+            # скачивания остаётся открытым до сборки мусора
+            aclose = getattr(chunks, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    async def get_file_url(self, s3_key, expires_in=3600):
+        """Получение временной ссылки на файл"""
+        return await self._run(self._get_file_url, s3_key, expires_in)
+    
+    async def delete_file(self, s3_key):
+        """Удаление файла из S3"""
+        return await self._run(self._delete_file, s3_key)
+    
+    async def get_file_info(self, s3_key):
+        """Получение информации о файле"""
+        return await self._run(self._get_file_info, s3_key)
+    
+    def _make_key(self, file_name, task_id=None):
+        """Уникальный file_id и ключ объекта в S3"""
+        # Генерируем уникальное имя файла
+        file_id = str(uuid.uuid4())
+        file_extension = os.path.splitext(file_name)[1].lower()
+        
+        # Создаем путь к файлу
+        folder = f"tasks/{task_id}" if task_id else "temp"
+        return file_id, f"{folder}/{file_id}{file_extension}"
+    
+    def _upload_file(self, file_data, file_name, content_type, task_id=None):
+        """Загрузка файла в S3 (выполняется в пуле потоков)"""
+        try:
+            file_id, s3_key = self._make_key(file_name, task_id)
             
             # Загружаем файл
             self.s3_client.put_object(
@@ -46,67 +306,94 @@ class FileStorage:
                 }
             )
             
-            # Создаем превью для изображений
-            thumbnail_key = None
-            if self.is_image(content_type):
-                thumbnail_key = self.create_thumbnail(file_data, s3_key)
-            
             return {
                 'file_id': file_id,
                 's3_key': s3_key,
-                'thumbnail_key': thumbnail_key,
+                'thumbnail_key': None,
                 'original_name': file_name,
                 'content_type': content_type,
                 'size': len(file_data)
             }
             
         except Exception as e:
-            print(f"Ошибка загрузки файла: {e}")
+            logger.error(f"Ошибка загрузки файла: {e}")
             return None
     
-    def create_thumbnail(self, file_data, original_key):
-        """Создание превью для изображения"""
-        try:
-            # Открываем изображение
-            image = Image.open(io.BytesIO(file_data))
-            
-            # Создаем превью (максимум 300x300)
-            image.thumbnail((300, 300), Image.Resampling.LANCZOS)
-            
-            # Сохраняем в буфер
-            buffer = io.BytesIO()
-            format_map = {
-                'image/jpeg': 'JPEG',
-                'image/png': 'PNG',
-                'image/gif': 'GIF',
-                'image/webp': 'WEBP'
+    def _create_multipart_upload(self, s3_key, file_name, content_type):
+        """Начало multipart-загрузки, возвращает UploadId"""
+        response = self.s3_client.create_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            ContentType=content_type,
+            Metadata={
+                'original_name': file_name,
+                'upload_time': datetime.now().isoformat()
             }
-            
-            # Определяем формат
-            if image.format in format_map.values():
-                save_format = image.format
-            else:
-                save_format = 'JPEG'
-            
-            image.save(buffer, format=save_format, quality=85)
-            buffer.seek(0)
-            
-            # Загружаем превью
-            thumbnail_key = original_key.replace('.', '_thumb.')
-            self.s3_client.put_object(
+        )
+        return response['UploadId']
+    
+    def _upload_part(self, s3_key, upload_id, part_number, data):
+        """Загрузка одной части, возвращает описание части для завершения"""
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+    
+    def _complete_multipart_upload(self, s3_key, upload_id, parts):
+        """Сборка объекта из загруженных частей"""
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    
+    def _abort_multipart_upload(self, s3_key, upload_id):
+        """Отмена multipart-загрузки (загруженные части удаляются)"""
+        try:
+            self.s3_client.abort_multipart_upload(
                 Bucket=self.bucket_name,
-                Key=thumbnail_key,
-                Body=buffer.getvalue(),
-                ContentType=f'image/{save_format.lower()}'
+                Key=s3_key,
+                UploadId=upload_id
             )
-            
-            return thumbnail_key
-            
         except Exception as e:
-            print(f"Ошибка создания превью: {e}")
+            logger.error(f"Ошибка отмены multipart-загрузки: {e}")
+    
+    def _object_exists(self, s3_key):
+        """Проверка наличия объекта в S3"""
+        from botocore.exceptions import ClientError
+        
+        try:
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def _get_object_data(self, s3_key, max_size):
+        """Содержимое объекта или None, если он больше max_size"""
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+        if response['ContentLength'] > max_size:
+            response['Body'].close()
+            logger.warning(f"Файл {s3_key} слишком большой для превью")
             return None
+        return response['Body'].read()
+    
+    def _put_thumbnail(self, thumbnail_key, data, save_format):
+        """Загрузка готового превью"""
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=thumbnail_key,
+            Body=data,
+            ContentType=f'image/{save_format.lower()}'
+        )
     
-    def get_file_url(self, s3_key, expires_in=3600):
+    def _get_file_url(self, s3_key, expires_in=3600):
         """Получение временной ссылки на файл"""
         try:
             url = self.s3_client.generate_presigned_url(
@@ -116,16 +403,16 @@ class FileStorage:
             )
             return url
         except Exception as e:
-            print(f"Ошибка генерации URL: {e}")
+            logger.error(f"Ошибка генерации URL: {e}")
             return None
     
-    def delete_file(self, s3_key):
+    def _delete_file(self, s3_key):
         """Удаление файла из S3"""
         try:
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
             return True
         except Exception as e:
-            print(f"Ошибка удаления файла: {e}")
+            logger.error(f"Ошибка удаления файла: {e}")
             return False
     
     def is_image(self, content_type):
@@ -138,7 +425,7 @@ class FileStorage:
         max_size = 100 * 1024 * 1024  # 100 МБ
         return file_size <= max_size
     
-    def get_file_info(self, s3_key):
+    def _get_file_info(self, s3_key):
         """Получение информации о файле"""
         try:
             response = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
@@ -149,8 +436,16 @@ class FileStorage:
                 'metadata': response.get('Metadata', {})
             }
         except Exception as e:
-            print(f"Ошибка получения информации о файле: {e}")
+            logger.error(f"Ошибка получения информации о файле: {e}")
             return None
 
-# Глобальный экземпляр для использования
-file_storage = FileStorage()
\ No newline at end of file
+# Глобальный экземпляр, создается при первом использовании
+_file_storage = None
+
+def get_file_storage():
+    """Общий экземпляр FileStorage (переживает тёплые вызовы функции)"""
+    global _file_storage
+    
+    if _file_storage is None:
+        _file_storage = FileStorage()
+    return _file_storage
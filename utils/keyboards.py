@@ -1,4 +1,7 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 def get_main_keyboard(role):
     """Главная клавиатура в зависимости от роли пользователя"""
@@ -129,4 +132,4 @@ async def clear_previous_messages(bot, chat_id, count=10):
                 continue
                 
     except Exception as e:
-        print(f"Ошибка очистки сообщений: {e}")
\ No newline at end of file
+        logger.error(f"Ошибка очистки сообщений: {e}")
\ No newline at end of file
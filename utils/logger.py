@@ -0,0 +1,125 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# Уровень логов и доля обновлений, для которых пишутся debug-записи
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+
+# Контекст текущего обновления: в пачке у каждого чата своя задача asyncio,
+# поэтому значения не пересекаются между параллельными обновлениями
+_update_id = contextvars.ContextVar('update_id', default=None)
+_debug_sampled = contextvars.ContextVar('debug_sampled', default=None)
+
+# Стандартные атрибуты LogRecord - всё остальное из extra попадает в JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'update_id'}
+
+_log_queue = queue.Queue(-1)
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись (разбирается Cloud Logging)"""
+
+    def format(self, record):
+        entry = {
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+
+        if getattr(record, 'update_id', None) is not None:
+            entry['update_id'] = record.update_id
+
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class UpdateContextFilter(logging.Filter):
+    """Добавляет update_id и отбрасывает debug-записи невыбранных обновлений"""
+
+    def filter(self, record):
+        record.update_id = _update_id.get()
+
+        if record.levelno <= logging.DEBUG:
+            sampled = _debug_sampled.get()
+            if sampled is None:
+                sampled = random.random() < DEBUG_SAMPLE_RATE
+            return sampled
+
+        return True
+
+class _UpdateQueueHandler(QueueHandler):
+    """
+    Запись форматируется в потоке вызова (аргументы и исключение),
+    JSON и вывод в stdout - в потоке QueueListener
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+def setup_logging():
+    """Настройка корневого логгера: очередь в памяти и фоновый вывод JSON в stdout"""
+    global _listener
+
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = _UpdateQueueHandler(_log_queue)
+    queue_handler.addFilter(UpdateContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(_log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def get_logger(name):
+    """Логгер модуля"""
+    setup_logging()
+    return logging.getLogger(name)
+
+def bind_update(update_id):
+    """
+    Привязка записей текущей задачи к обновлению и выбор debug-сэмпла.
+    Повторная привязка того же обновления сохраняет решение о сэмпле
+    """
+    if update_id is not None and _update_id.get() == update_id and _debug_sampled.get() is not None:
+        return
+
+    _update_id.set(update_id)
+    _debug_sampled.set(random.random() < DEBUG_SAMPLE_RATE)
+
+def flush_logs():
+    """
+    Ожидание вывода накопленных записей. Вызывается в конце вызова функции:
+    после ответа экземпляр может быть заморожен вместе с очередью
+    """
+    if _listener is not None:
+        _log_queue.join()
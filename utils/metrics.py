@@ -0,0 +1,161 @@
+import time
+import bisect
+import contextvars
+from contextlib import contextmanager
+
+# Границы корзин гистограммы, мс (последняя корзина - всё, что больше)
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# Категории внешних вызовов внутри обработки обновления
+SPAN_CATEGORIES = ('db', 's3', 'telegram')
+
+# Спаны текущего обновления. Словарь общий для задач, запущенных
+# из обработчика (asyncio.gather копирует контекст со ссылкой на него)
+_current_spans = contextvars.ContextVar('current_spans', default=None)
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, value_ms):
+        """Добавление измерения"""
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def percentile(self, q):
+        """Оценка перцентиля сверху - граница корзины, в которую он попал"""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return float(self.buckets[index]) if index < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def get_stats(self):
+        """Сводка гистограммы"""
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 1) if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_ms, 1),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['inf'], self.counts))
+        }
+
+# Гистограммы экземпляра функции: (обработчик, категория) -> LatencyHistogram
+_histograms = {}
+
+# Отдельные вызовы Bot API по методам: метод -> LatencyHistogram.
+# По ним оценивается время, сэкономленное ответом в теле вебхука
+_telegram_calls = {}
+
+# Сводка последнего завершённого обновления текущей задачи
+_last_summary = contextvars.ContextVar('last_summary', default=None)
+
+def start_update_spans():
+    """Начало сбора спанов для обновления"""
+    spans = {'handler': None, 'started': time.perf_counter()}
+    for category in SPAN_CATEGORIES:
+        spans[f'{category}_ms'] = 0.0
+    _current_spans.set(spans)
+    return spans
+
+def set_span_handler(name):
+    """Имя обработчика, выбранного для текущего обновления"""
+    spans = _current_spans.get()
+    if spans is not None:
+        spans['handler'] = name
+
+def add_span(category, duration_ms):
+    """Добавление длительности внешнего вызова к текущему обновлению"""
+    spans = _current_spans.get()
+    if spans is not None:
+        spans[f'{category}_ms'] += duration_ms
+
+@contextmanager
+def span(category):
+    """Замер блока кода как спана категории category"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(category, (time.perf_counter() - started) * 1000)
+
+def observe(handler, category, value_ms):
+    """Добавление измерения в гистограмму (обработчик, категория)"""
+    key = (handler, category)
+    if key not in _histograms:
+        _histograms[key] = LatencyHistogram()
+    _histograms[key].observe(value_ms)
+
+def observe_telegram_call(method, duration_ms):
+    """Учет отдельного вызова метода Bot API"""
+    if method not in _telegram_calls:
+        _telegram_calls[method] = LatencyHistogram()
+    _telegram_calls[method].observe(duration_ms)
+
+def record_inline_reply(method):
+    """
+    Учет ответа методом method в теле вебхука для последнего обновления.
+    Сэкономленное время - среднее время того же метода при отдельном вызове
+    на этом экземпляре. Записывается для обработчика в гистограммы
+    inline_saved и total_without_inline (время обработки с вызовом).
+    Возвращает оценку в мс или None, пока отдельных вызовов метода не было
+    """
+    summary = _last_summary.get()
+    calls = _telegram_calls.get(method)
+    if summary is None or calls is None or not calls.count:
+        return None
+
+    saved_ms = round(calls.total_ms / calls.count, 1)
+    observe(summary['handler'], 'inline_saved', saved_ms)
+    observe(summary['handler'], 'total_without_inline', summary['total_ms'] + saved_ms)
+    return saved_ms
+
+def finish_update_spans(spans):
+    """
+    Завершение сбора: итог по категориям, время Python (остаток)
+    и запись в гистограммы. Возвращает сводку в мс.
+    Параллельные вызовы суммируются, поэтому категория может превышать total
+    """
+    total_ms = (time.perf_counter() - spans['started']) * 1000
+    handler = spans['handler'] or 'unhandled'
+
+    summary = {'handler': handler, 'total_ms': round(total_ms, 1)}
+    external_ms = 0.0
+    for category in SPAN_CATEGORIES:
+        value = spans[f'{category}_ms']
+        external_ms += value
+        summary[f'{category}_ms'] = round(value, 1)
+    summary['python_ms'] = round(max(total_ms - external_ms, 0.0), 1)
+
+    for category in SPAN_CATEGORIES + ('python', 'total'):
+        observe(handler, category, summary[f'{category}_ms'])
+
+    _current_spans.set(None)
+    _last_summary.set(summary)
+    return summary
+
+def get_latency_stats():
+    """Гистограммы задержек: {обработчик: {категория: сводка}}"""
+    stats = {}
+    for (handler, category), histogram in _histograms.items():
+        stats.setdefault(handler, {})[category] = histogram.get_stats()
+    return stats
+
+def reset_latency_stats():
+    """Сброс гистограмм (для замеров и бенчмарков)"""
+    _histograms.clear()
+    _telegram_calls.clear()
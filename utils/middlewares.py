@@ -0,0 +1,49 @@
+import time
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from database.models import UserManager
+from utils.metrics import set_span_handler, add_span, observe_telegram_call
+
+class UserMiddleware(BaseMiddleware):
+    """
+    Получение пользователя один раз на обновление.
+    Результат передаётся обработчикам в аргументе user (None, если
+    пользователь не зарегистрирован)
+    """
+    
+    async def __call__(self, handler, event, data):
+        from_user = data.get('event_from_user')
+        
+        user = None
+        if from_user:
+            user = await UserManager.get_user_by_telegram_id(from_user.id)
+        
+        data['user'] = user
+        return await handler(event, data)
+
+class LatencyMiddleware(BaseMiddleware):
+    """
+    Имя выбранного обработчика для спанов обновления
+    (внутренний middleware - вызывается после фильтров)
+    """
+    
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        if handler_object:
+            set_span_handler(handler_object.callback.__name__)
+        return await handler(event, data)
+
+class TelegramSpanMiddleware(BaseRequestMiddleware):
+    """
+    Замер времени вызовов Bot API: спан обновления и время по методу
+    (для оценки экономии от ответа в теле вебхука)
+    """
+    
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            add_span('telegram', duration_ms)
+            observe_telegram_call(method.__api_method__, duration_ms)